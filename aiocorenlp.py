@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+#
+# aiocorenlp  - asyncio driver for Stanford CoreNLP
+# Copyright (c) 2014 Dustin Smith
+#   https://github.com/dasmith/stanford-corenlp-python
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+CoreNLP from an asyncio event loop.  AsyncStanfordCoreNLP runs `size`
+CoreNLP processes and talks to them through asyncio subprocess streams,
+so any number of coroutines can await parses at once without threads:
+they queue up and each text goes to the next free process.
+
+    async with AsyncStanfordCoreNLP(size=2) as nlp:
+        result = await nlp._parse("Hello world.", timeout=10)
+
+As in StanfordCoreNLPPool, parse() returns JSON and _parse() the Python
+data-structure; a full queue raises RPCServerBusy and a missed deadline
+RPCDeadlineExceeded.  Cancelling an awaiting coroutine drops its text if
+it is still queued; if it is already being parsed, the process still
+reads the output to its end, so it stays in step for the next text.
+A process that exits is restarted, retrying with a growing delay; while
+none is running, parses fail with EOFError rather than wait.
+"""
+
+import asyncio
+import json
+import re
+import shlex
+import time
+
+import jsonrpc
+import metrics
+from corenlp import PROMPT, ProcessTimeout, java_command, logger, max_expected_time, parse_parser_results
+
+# the stream has to hold a whole output before the prompt is found in it
+STREAM_LIMIT = 1 << 30
+# seconds to wait for each of the models (see StanfordCoreNLP.__init__)
+LOAD_TIMEOUTS = (20, 200, 600, 600, 200)
+
+
+class CoreNLPProcess(object):
+    """ One CoreNLP process, driven through asyncio streams """
+    def __init__(self, command, tree=False, coref_index=False):
+        self.command = command
+        self.tree = tree
+        self.coref_index = coref_index
+        self.process = None
+        self.desynced = False
+
+    async def start(self):
+        """ Spawns the process and waits until its models are loaded """
+        self.process = await asyncio.create_subprocess_exec(
+            *shlex.split(self.command), stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT, limit=STREAM_LIMIT)
+        for timeout in LOAD_TIMEOUTS:
+            await self._expect(r"done.", timeout)
+        await self._expect(r"Entering interactive shell.", 30)
+        await self._read_prompt(PROMPT.lstrip(), 30)
+
+    async def _expect(self, pattern, timeout):
+        """
+        Reads lines until one matches the regular expression pattern.
+        Raises ProcessTimeout if none does within timeout seconds.
+        """
+        pattern = re.compile(pattern)
+        end_time = time.time() + timeout
+        while True:
+            try:
+                line = await asyncio.wait_for(self.process.stdout.readline(),
+                                              max(0, end_time - time.time()))
+            except asyncio.TimeoutError:
+                raise ProcessTimeout("no %r after %s seconds" % (pattern.pattern, timeout))
+            if not line:
+                raise EOFError("CoreNLP exited")
+            if pattern.search(line.decode('utf-8', 'replace')):
+                return
+
+    async def _read_prompt(self, prompt, timeout):
+        """
+        The output up to and including the prompt.  Raises
+        asyncio.TimeoutError, leaving the output read so far in the
+        stream, if the prompt doesn't come within timeout seconds.
+        """
+        try:
+            output = await asyncio.wait_for(self.process.stdout.readuntil(prompt.encode('utf-8')), timeout)
+        except asyncio.IncompleteReadError:
+            raise EOFError("CoreNLP exited")
+        return output.decode('utf-8', 'replace')
+
+    async def communicate(self, text):
+        """
+        Sends the text and returns CoreNLP's output for it, or None if
+        it timed out
+        """
+        # the shell parses one line per document
+        text = text.replace("\r", " ").replace("\n", " ")
+        # an empty line is answered with a bare prompt, and "q" quits
+        if not text.strip():
+            return ""
+        if text.strip().lower() == "q":
+            raise jsonrpc.RPCInvalidParamValues("%r would quit CoreNLP's shell" % text)
+
+        # a timed out request's output is still on its way: skip it
+        if self.desynced:
+            with metrics.REGISTRY.timer('drain'):
+                try:
+                    await self._read_prompt(PROMPT, 40)
+                except asyncio.TimeoutError:
+                    logger.error("Error: No prompt after a timed out request")
+            self.desynced = False
+
+        self.process.stdin.write((text + "\n").encode('utf-8'))
+        await self.process.stdin.drain()
+        try:
+            return await self._read_prompt(PROMPT, max_expected_time(text))
+        except asyncio.TimeoutError:
+            logger.error("Error: Timeout with input '%s'" % text)
+            metrics.REGISTRY.incr('timeouts')
+            self.desynced = True
+            return None
+
+    async def parse(self, text):
+        """ The Python data-structure for the text, as StanfordCoreNLP._parse() """
+        start_time = time.time()
+        incoming = await self.communicate(text)
+        metrics.REGISTRY.observe('java_parse', time.time() - start_time)
+        if incoming is None:
+            return {'error': "timed out after %f seconds" % max_expected_time(text)}
+        # in a thread, so a long output doesn't hold up the event loop
+        with metrics.REGISTRY.timer('parse_parser_results'):
+            return await asyncio.get_running_loop().run_in_executor(
+                None, parse_parser_results, incoming, self.tree, self.coref_index)
+
+    async def close(self):
+        """ Stops the process """
+        if self.process is None or self.process.returncode is not None:
+            return
+        self.process.stdin.close()
+        try:
+            await asyncio.wait_for(self.process.wait(), 5)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+
+
+class AsyncStanfordCoreNLP(object):
+    """
+    Several CoreNLP processes serving one queue of texts, awaited from
+    coroutines.  Must be started (and eventually closed) from a running
+    event loop, e.g. with `async with`.
+    """
+    def __init__(self, size=1, corenlp_path=None, command=None, queue_size=0, timeout=None,
+                 tree=False, coref_index=False):
+        """
+        Runs `size` CoreNLP processes (see StanfordCoreNLP for the other
+        arguments).  At most `queue_size` texts wait for a free process
+        (0 = no limit), and _parse() calls without a timeout of their own
+        get `timeout`.
+        """
+        if command is None:
+            command = java_command(corenlp_path)
+        self.processes = [CoreNLPProcess(command, tree, coref_index) for i in range(size)]
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.queue = None
+        self.workers = []
+        self.down = set()   # processes that couldn't be restarted yet
+
+    async def start(self):
+        """ Spawns the processes (concurrently) and their workers """
+        logger.info("Loading models of %d processes" % len(self.processes))
+        await asyncio.gather(*[process.start() for process in self.processes])
+        self.queue = asyncio.Queue()
+        self.workers = [asyncio.ensure_future(self._work(i)) for i in range(len(self.processes))]
+        return self
+
+    async def close(self):
+        """ Stops the workers and processes; queued texts are cancelled """
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        while self.queue is not None and not self.queue.empty():
+            text, future, queued_at = self.queue.get_nowait()
+            future.cancel()
+        await asyncio.gather(*[process.close() for process in self.processes])
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _work(self, i):
+        """ Worker task: parses queued texts with process i """
+        while True:
+            text, future, queued_at = await self.queue.get()
+            metrics.REGISTRY.observe('queue_wait', time.time() - queued_at)
+            if future.done():
+                continue   # cancelled or timed out while queued
+            try:
+                result = await self.processes[i].parse(text)
+            except EOFError as e:
+                logger.error("Error: CoreNLP process %d exited, restarting it" % i)
+                metrics.REGISTRY.incr('worker_restarts')
+                if not future.done():
+                    future.set_exception(e)
+                await self._restart(i)
+                continue
+            except Exception as e:
+                metrics.REGISTRY.incr('errors')
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            if not future.done():
+                future.set_result(result)
+
+    async def _restart(self, i):
+        """
+        Replaces process i, retrying with a growing delay until a new one
+        starts.  While no process is left, queued texts fail instead of
+        waiting for one.
+        """
+        delay = 1
+        while True:
+            process = self.processes[i]
+            await process.close()
+            self.processes[i] = CoreNLPProcess(process.command, process.tree, process.coref_index)
+            try:
+                await self.processes[i].start()
+                self.down.discard(i)
+                return
+            except (EOFError, ProcessTimeout, OSError) as e:
+                logger.error("Error: Could not restart CoreNLP process %d: %s" % (i, e))
+                self.down.add(i)
+            if len(self.down) == len(self.processes):
+                while not self.queue.empty():
+                    text, future, queued_at = self.queue.get_nowait()
+                    if not future.done():
+                        future.set_exception(EOFError("no CoreNLP process is running"))
+            await asyncio.sleep(delay)
+            delay = min(2 * delay, 60)
+
+    async def _parse(self, text, timeout=None):
+        """
+        Queues the text and returns the Python data-structure once a
+        process parsed it.  Fails with RPCDeadlineExceeded if not done
+        within `timeout` seconds.
+        """
+        if self.queue is None:
+            raise RuntimeError("AsyncStanfordCoreNLP isn't started")
+        if len(self.down) == len(self.processes):
+            raise EOFError("no CoreNLP process is running")
+        if self.queue_size and self.queue.qsize() >= self.queue_size:
+            metrics.REGISTRY.incr('rejected')
+            raise jsonrpc.RPCServerBusy("%d texts queued" % self.queue.qsize())
+        metrics.REGISTRY.incr('requests')
+        if isinstance(text, bytes):
+            text = text.decode('utf-8')
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((text, future, time.time()))
+        timeout = timeout or self.timeout
+        if timeout is None:
+            return await future
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            metrics.REGISTRY.incr('deadline_exceeded')
+            raise jsonrpc.RPCDeadlineExceeded("not parsed within the deadline")
+
+    async def parse(self, text, timeout=None):
+        """ Same as StanfordCoreNLPPool.parse(), awaited """
+        response = await self._parse(text, timeout)
+        with metrics.REGISTRY.timer('json_dumps'):
+            return json.dumps(response)
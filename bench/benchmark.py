@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+#
+# benchmark  - reproducible performance measurements for corenlp.py
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+
+"""
+Measures throughput and latency of the Python side of the wrapper against
+the CoreNLP stand-in in fake_corenlp.py, so no jars are needed:
+
+  - parse_parser_results on recorded output of n-sentence documents
+  - parse_coreference on the coreference sets of such output
+  - JsonRpc20 serialization of a parse request and response
+  - StanfordCoreNLP._parse end to end, through the pipes
+  - parse calls over TCP to a server with a pool of fake workers, at
+    several levels of client concurrency
+  - the same from coroutines awaiting an AsyncStanfordCoreNLP
+
+Every run uses the same inputs and iteration counts, and writes a JSON
+report that a later run can be compared against:
+
+    python bench/benchmark.py -o before.json
+    python bench/benchmark.py -o after.json -c before.json
+
+With --verify it instead checks parse_parser_results against the golden
+results in bench/recorded/*.json (see golden_results()), and with
+--update-golden rewrites them after an intended change of the output.
+"""
+
+import asyncio
+import glob
+import json
+import optparse
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import aiocorenlp
+import corenlp
+import jsonrpc
+from fake_corenlp import Corpus, RECORDED
+
+
+def fake_command(latency=0.0, per_sentence=0.0, scale=1):
+    return "%s %s --latency %s --per-sentence %s --scale %d" % (
+        sys.executable, os.path.join(HERE, 'fake_corenlp.py'), latency, per_sentence, scale)
+
+
+def percentile(times, q):
+    return times[min(len(times) - 1, int(q * len(times)))]
+
+
+def summarize(times, wall=None):
+    """ Latency statistics (in seconds) of a list of durations """
+    times = sorted(times)
+    wall = wall or sum(times)
+    return {'n': len(times),
+            'mean': sum(times) / len(times),
+            'min': times[0],
+            'p50': percentile(times, 0.5),
+            'p95': percentile(times, 0.95),
+            'p99': percentile(times, 0.99),
+            'max': times[-1],
+            'ops_per_sec': len(times) / wall}
+
+
+def measure(function, iterations):
+    """ Runs function() `iterations` times (after one warm-up call) """
+    function()
+    times = []
+    for i in range(iterations):
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+    return summarize(times)
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def bench_parse_parser_results(corpus, options):
+    results = {}
+    for n in options.sizes:
+        output = corpus.text(n) + '\n' + corpus.synthesize(n)
+        iterations = max(5, options.iterations * 10 // n)
+        results['parse_parser_results/%d' % n] = measure(
+            lambda: corenlp.parse_parser_results(output), iterations)
+    return results
+
+
+def bench_coref(corpus, options):
+    results = {}
+    for n in options.sizes:
+        lines = [line for line in corpus.synthesize(n).split('\n') if ' -> ' in line]
+        iterations = max(5, options.iterations * 10 // n)
+        def parse():
+            for line in lines:
+                corenlp.parse_coreference(line)
+        results['coref/%d' % n] = measure(parse, iterations)
+    return results
+
+
+def bench_jsonrpc(corpus, options):
+    results = {}
+    rpc = jsonrpc.JsonRpc20()
+    for n in options.sizes:
+        text = corpus.text(n)
+        response = json.dumps(corenlp.parse_parser_results(corpus.synthesize(n)))
+        iterations = max(5, options.iterations * 10 // n)
+        def roundtrip():
+            rpc.loads_request(rpc.dumps_request('parse', [text], 1))
+            rpc.loads_response(rpc.dumps_response(response, 1))
+        results['jsonrpc/%d' % n] = measure(roundtrip, iterations)
+    return results
+
+
+def bench_parse(corpus, options):
+    results = {}
+    for n in options.sizes:
+        nlp = corenlp.StanfordCoreNLP(command=fake_command())
+        text = corpus.text(n)
+        results['_parse/%d' % n] = measure(lambda: nlp._parse(text), options.parse_iterations)
+        nlp.close()
+    return results
+
+
+def bench_tcp(corpus, options):
+    results = {}
+    port = free_port()
+    pool = corenlp.StanfordCoreNLPPool(options.workers, queue_size=0,
+                                       command=fake_command(options.latency),
+                                       processes=options.processes)
+    server = jsonrpc.Server(jsonrpc.JsonRpc20(),
+                            jsonrpc.TransportTcpIp(addr=('127.0.0.1', port)))
+    server.register_function(pool.parse)
+    thread = threading.Thread(target=server.serve)
+    thread.daemon = True
+    thread.start()
+    time.sleep(0.5)
+    text = corpus.text(options.tcp_size)
+
+    for concurrency in options.concurrency:
+        times = []
+        def client():
+            proxy = jsonrpc.ServerProxy(jsonrpc.JsonRpc20(),
+                                        jsonrpc.TransportTcpIp(addr=('127.0.0.1', port), timeout=60))
+            for i in range(options.tcp_requests):
+                start = time.time()
+                proxy.parse(text)
+                times.append(time.time() - start)
+        clients = [threading.Thread(target=client) for i in range(concurrency)]
+        start = time.time()
+        for c in clients:
+            c.start()
+        for c in clients:
+            c.join()
+        results['tcp/c%d' % concurrency] = summarize(times, time.time() - start)
+    return results
+
+
+def bench_async(corpus, options):
+    results = {}
+    text = corpus.text(options.tcp_size)
+
+    async def run(nlp, concurrency):
+        times = []
+        async def client():
+            for i in range(options.tcp_requests):
+                start = time.time()
+                await nlp.parse(text)
+                times.append(time.time() - start)
+        start = time.time()
+        await asyncio.gather(*[client() for i in range(concurrency)])
+        return summarize(times, time.time() - start)
+
+    async def main():
+        async with aiocorenlp.AsyncStanfordCoreNLP(options.workers,
+                                                   command=fake_command(options.latency)) as nlp:
+            for concurrency in options.concurrency:
+                results['async/c%d' % concurrency] = await run(nlp, concurrency)
+
+    asyncio.run(main())
+    return results
+
+
+BENCHMARKS = [('parse_parser_results', bench_parse_parser_results),
+              ('coref', bench_coref),
+              ('jsonrpc', bench_jsonrpc),
+              ('_parse', bench_parse),
+              ('tcp', bench_tcp),
+              ('async', bench_async)]
+
+
+def golden_results(corpus):
+    """
+    Yields (golden file, its expected contents) for every recording -- its
+    parse_parser_results -- and for a large document synthesized from all
+    recordings -- just its coreference sets.
+    """
+    for path in sorted(glob.glob(os.path.join(RECORDED, '*.txt'))):
+        output = open(path, encoding='utf-8').read().split('\n', 1)[1]
+        yield path[:-4] + '.json', corenlp.parse_parser_results(output)
+    output = corpus.synthesize(100)
+    yield os.path.join(RECORDED, 'synthesized-100.coref.json'), corenlp.parse_parser_results(output)['coref']
+
+
+def verify(corpus, update=False):
+    """ Compares (or with update, overwrites) the golden files; returns the failures """
+    failed = []
+    for path, result in golden_results(corpus):
+        result = json.loads(json.dumps(result))
+        if update:
+            json.dump(result, open(path, 'w'), indent=1, sort_keys=True)
+        elif not os.path.exists(path) or json.load(open(path)) != result:
+            failed.append(path)
+        print('%-48s %s' % (os.path.basename(path), update and 'written' or path in failed and 'FAILED' or 'ok'), file=sys.stderr)
+    return failed
+
+
+def version():
+    """ The git revision of the code under test """
+    try:
+        return subprocess.Popen(['git', 'describe', '--always', '--dirty'], cwd=HERE,
+                                stdout=subprocess.PIPE).communicate()[0].decode().strip()
+    except OSError:
+        return 'unknown'
+
+
+def compare(report, baseline):
+    """ Prints the p50 latency of both reports side by side """
+    print('%-32s %12s %12s %8s' % ('benchmark', baseline['version'], report['version'], 'change'))
+    for name in sorted(report['results']):
+        if name not in baseline['results']:
+            continue
+        old = baseline['results'][name]['p50']
+        new = report['results'][name]['p50']
+        print('%-32s %10.3fms %10.3fms %+7.1f%%' % (name, old * 1000, new * 1000, (new - old) / old * 100))
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [OPTIONS]")
+    parser.add_option('-o', '--output', help='Write the JSON report to this file')
+    parser.add_option('-c', '--compare', help='Compare against the JSON report in this file')
+    parser.add_option('--verify', action='store_true', default=False,
+                      help='Check the parser against the golden files instead of benchmarking')
+    parser.add_option('--update-golden', action='store_true', default=False,
+                      help='Rewrite the golden files with the current output')
+    parser.add_option('-b', '--only', default='',
+                      help='Comma-separated benchmarks to run (default: all of %s)' % ', '.join(n for n, b in BENCHMARKS))
+    parser.add_option('--sizes', default='1,10,100',
+                      help='Document sizes in sentences (default: 1,10,100)')
+    parser.add_option('--iterations', type='int', default=100,
+                      help='Iterations for 10-sentence documents, scaled by size (default: 100)')
+    parser.add_option('--parse-iterations', type='int', default=10,
+                      help='Iterations of StanfordCoreNLP._parse per size (default: 10)')
+    parser.add_option('--concurrency', default='1,4,16',
+                      help='Concurrent TCP clients (default: 1,4,16)')
+    parser.add_option('--workers', type='int', default=4,
+                      help='Fake CoreNLP processes behind the TCP server (default: 4)')
+    parser.add_option('--processes', type='int', default=0,
+                      help='Post-processing processes of the TCP server (default: 0)')
+    parser.add_option('--latency', type='float', default=0.01,
+                      help='Seconds each fake CoreNLP process takes per TCP request (default: 0.01)')
+    parser.add_option('--tcp-size', type='int', default=10,
+                      help='Sentences per TCP request (default: 10)')
+    parser.add_option('--tcp-requests', type='int', default=20,
+                      help='Requests per TCP client (default: 20)')
+    options, args = parser.parse_args()
+    options.sizes = [int(n) for n in options.sizes.split(',')]
+    options.concurrency = [int(n) for n in options.concurrency.split(',')]
+    only = [name for name in options.only.split(',') if name]
+
+    corpus = Corpus()
+    if options.verify or options.update_golden:
+        sys.exit(verify(corpus, options.update_golden) and 1 or 0)
+
+    report = {'version': version(),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'options': dict((k, v) for k, v in vars(options).items() if k not in ('output', 'compare')),
+              'results': {}}
+    for name, benchmark in BENCHMARKS:
+        if only and name not in only:
+            continue
+        for key, result in sorted(benchmark(corpus, options).items()):
+            report['results'][key] = result
+            print('%-32s p50 %9.3fms  p95 %9.3fms  %10.1f ops/s' % (
+                key, result['p50'] * 1000, result['p95'] * 1000, result['ops_per_sec']), file=sys.stderr)
+
+    if options.output:
+        json.dump(report, open(options.output, 'w'), indent=2, sort_keys=True)
+    if options.compare:
+        compare(report, json.load(open(options.compare)))
+
+
+if __name__ == '__main__':
+    main()
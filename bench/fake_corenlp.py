@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+#
+# fake_corenlp  - stand-in for CoreNLP's interactive shell
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+
+"""
+Behaves like `java edu.stanford.nlp.pipeline.StanfordCoreNLP` in its
+interactive shell, without the multi-GB jars: it prints the model loading
+messages StanfordCoreNLP waits for, then answers every input line at the
+`NLP>` prompt by replaying recorded CoreNLP output.
+
+Recordings (bench/recorded/*.txt) hold an input line followed by the
+output CoreNLP printed for it.  A recorded input is answered verbatim;
+any other text is answered with as many recorded sentences as it has
+sentences (renumbered, cycling through all recordings) plus the matching
+coreference sets, so output size scales with the input like the real one.
+--scale multiplies the number of sentences in such answers to produce
+large outputs from short inputs.
+
+    python bench/fake_corenlp.py --latency 0.05 --per-sentence 0.01
+
+    nlp = StanfordCoreNLP(command="python bench/fake_corenlp.py")
+"""
+
+import glob
+import optparse
+import os
+import re
+import sys
+import time
+
+
+RECORDED = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recorded')
+SENTENCE_END = re.compile(r'[^.!?]+[.!?]')
+MENTION = re.compile(r'\((\d+),(\d+),\[(\d+),(\d+)\]\)')
+
+
+class Corpus(object):
+    """
+    The sentences and coreference sets of a set of recordings, numbered
+    consecutively across recordings.
+    """
+    def __init__(self, paths=None):
+        if not paths:
+            paths = sorted(glob.glob(os.path.join(RECORDED, '*.txt')))
+        self.replies = {}    # recorded input -> output
+        self.sentences = []  # (text, output block without "Sentence #n")
+        self.corefs = []     # coreference sets, as lists of mention lines
+        for path in paths:
+            self.load(path)
+
+    def load(self, path):
+        lines = open(path, encoding='utf-8').read().split('\n')
+        text, output = lines[0], '\n'.join(lines[1:])
+        self.replies[text] = output
+        offset = len(self.sentences)
+        blocks = output.split('Sentence #')[1:]
+        blocks[-1], _, coref = blocks[-1].partition('Coreference set:')
+        for block in blocks:
+            header, body = block.split(' ', 1)
+            self.sentences.append((body.split('\n')[1], body))
+        for chain in coref.split('Coreference set:'):
+            mentions = [shift(line, offset) for line in chain.split('\n') if line.strip()]
+            if mentions:
+                self.corefs.append(mentions)
+
+    def text(self, n):
+        """ An input text of n recorded sentences """
+        return ' '.join(self.sentences[i % len(self.sentences)][0] for i in range(n))
+
+    def reply(self, text, scale=1):
+        """ The output for text, and its number of sentences """
+        if text in self.replies:
+            output = self.replies[text]
+            return output, output.count('Sentence #')
+        n = max(1, len(SENTENCE_END.findall(text))) * scale
+        return self.synthesize(n), n
+
+    def synthesize(self, n):
+        """ CoreNLP's output for n sentences cycling through the corpus """
+        output = []
+        for i in range(n):
+            output.append('Sentence #%d %s' % (i + 1, self.sentences[i % len(self.sentences)][1]))
+        for start in range(0, n, len(self.sentences)):
+            for chain in self.corefs:
+                mentions = [shift(line, start) for line in chain]
+                if max(max_sentence(line) for line in mentions) <= n:
+                    output.append('Coreference set:\n' + '\n'.join(mentions) + '\n')
+        return ''.join(output)
+
+
+def shift(line, offset):
+    """ Adds offset to the sentence numbers of a coreference line """
+    return MENTION.sub(lambda m: '(%d,%s,[%s,%s])' % ((int(m.group(1)) + offset,) + m.groups()[1:]), line)
+
+
+def max_sentence(line):
+    return max(int(m.group(1)) for m in MENTION.finditer(line))
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [OPTIONS] [RECORDING ...]")
+    parser.add_option('--latency', type='float', default=0.0,
+                      help='Seconds to "parse" each input (default: 0)')
+    parser.add_option('--per-sentence', type='float', default=0.0,
+                      help='Additional seconds per sentence (default: 0)')
+    parser.add_option('--load-time', type='float', default=0.0,
+                      help='Seconds to "load the models" (default: 0)')
+    parser.add_option('--scale', type='int', default=1,
+                      help='Output sentences per input sentence of unrecorded texts (default: 1)')
+    options, paths = parser.parse_args()
+    corpus = Corpus(paths)
+    # CoreNLP reads and writes UTF-8, whatever the locale
+    sys.stdin.reconfigure(encoding='utf-8')
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    # the messages StanfordCoreNLP.__init__ waits for
+    for model in ('POS tagger', 'NER 3class', 'NER 7class', 'NER MISC', 'PCFG parser'):
+        time.sleep(options.load_time / 5)
+        sys.stderr.write('Loading %s model from recording ... done [%.1f sec].\n' % (model, options.load_time / 5))
+    sys.stderr.write('\nEntering interactive shell. Type q RETURN or EOF to quit.\n')
+    sys.stderr.flush()
+
+    while True:
+        sys.stdout.write('NLP> ')
+        sys.stdout.flush()
+        line = sys.stdin.readline()
+        if not line or line.strip() == 'q':
+            break
+        text = line.strip()
+        if not text:
+            continue
+        output, n = corpus.reply(text, options.scale)
+        time.sleep(options.latency + n * options.per_sentence)
+        sys.stdout.write(output + '\n')
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
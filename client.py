@@ -1,19 +1,254 @@
+import bisect
+import collections
+import concurrent.futures
+import hashlib
 import json
+import random
+import threading
+import time
+import jsonrpc
+import trees
 from jsonrpc import ServerProxy, JsonRpc20, TransportTcpIp
 from pprint import pprint
 
 class StanfordNLP:
-    def __init__(self):
-        self.server = ServerProxy(JsonRpc20(),
-                                  TransportTcpIp(addr=("127.0.0.1", 8080)))
-    
+    def __init__(self, host="127.0.0.1", port=8080, timeout=5.0, unix=None, shm_threshold=0):
+        """
+        Connects to host:port, or to the Unix socket at `unix` of a
+        server on the same host (see corenlp.py --unix), handing requests
+        and responses of `shm_threshold` bytes or more over in shared memory.
+        """
+        if unix is not None:
+            transport = jsonrpc.TransportUnixSocket(addr=unix, timeout=timeout, shm_threshold=shm_threshold)
+        else:
+            transport = TransportTcpIp(addr=(host, port), timeout=timeout)
+        self.server = ServerProxy(JsonRpc20(), transport)
+
     def parse(self, text):
         return json.loads(self.server.parse(text))
 
-nlp = StanfordNLP()
-result = nlp.parse("Hello world!  It is so beautiful.")
-pprint(result)
 
-from nltk.tree import Tree
-tree = Tree.parse(result['sentences'][0]['parsetree'])
-pprint(tree)
+def hash_key(s):
+    """ Position of a string on the hash ring """
+    if isinstance(s, str):
+        s = s.encode('utf-8')
+    return int(hashlib.md5(s).hexdigest()[:16], 16)
+
+
+class Node(object):
+    """ One corenlp.py server of a StanfordNLPCluster """
+    def __init__(self, addr, timeout):
+        self.addr = addr
+        self.timeout = timeout
+        self.healthy = True
+        self.outstanding = 0   # requests in flight
+        self.lock = threading.Lock()
+
+    def proxy(self, timeout=None):
+        # a proxy per call, so that threads don't wait for each other
+        return ServerProxy(JsonRpc20(), TransportTcpIp(addr=self.addr, timeout=timeout or self.timeout))
+
+    def __repr__(self):
+        return "<Node %s:%d%s>" % (self.addr[0], self.addr[1], not self.healthy and " (down)" or "")
+
+
+class RetryBudget(object):
+    """
+    Limits retries (and hedged requests) to a share of the requests, so
+    that when the servers are overloaded the clients don't multiply their
+    load: every request adds `ratio` tokens, every retry takes one.  The
+    tokens are capped at `reserve`, which also allows that many retries
+    to begin with.
+    """
+    def __init__(self, ratio=0.2, reserve=10):
+        self.ratio = ratio
+        self.reserve = reserve
+        self.tokens = float(reserve)
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.reserve, self.tokens + self.ratio)
+
+    def withdraw(self):
+        """ True if a retry may be made """
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+def backoff(attempt, base, cap):
+    """ Seconds to wait before retry number `attempt` (exponential, with full jitter) """
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class StanfordNLPCluster(object):
+    """
+    Spreads parse requests over several corenlp.py servers.
+
+    With strategy="hash", every text goes to the server it hashes to on a
+    consistent-hash ring (so repeated texts hit the same server's cache,
+    and adding or removing a server only moves 1/n of the texts).  With
+    strategy="least-outstanding", it goes to the server with the fewest
+    requests in flight from this client.
+
+    A server that can't be reached is marked down.  Failed requests
+    (unreachable, timed out or busy servers) are retried on the next
+    server, up to `retries` times, after an exponential backoff of
+    `backoff` seconds doubling up to `max_backoff`, and only as far as the
+    `budget` (a RetryBudget) allows.  A background thread probes all
+    servers every `check_interval` seconds and brings recovered ones back.
+
+    parse() requests have a deadline, `deadline` seconds unless given: no
+    retry is made past it, and the time left is sent along to the server
+    as the request's timeout, so it drops requests nobody waits for
+    anymore.  With `hedge`, a quantile like 0.95, a request that takes
+    longer than that share of the recent requests is also sent to the
+    next server, and the first answer wins.
+    """
+    def __init__(self, addresses, strategy="hash", replicas=100, timeout=60.0, check_interval=5.0,
+                 retries=2, backoff=0.05, max_backoff=2.0, budget=None, deadline=None, hedge=None):
+        """
+        addresses is a list of (host, port) pairs; each server gets
+        `replicas` points on the hash ring.  `timeout` is the socket
+        timeout of requests without a deadline.
+        """
+        if strategy not in ("hash", "least-outstanding"):
+            raise ValueError("unknown strategy %r" % strategy)
+        self.strategy = strategy
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget = budget or RetryBudget()
+        self.deadline = deadline
+        self.hedge = hedge
+        self.latencies = collections.deque(maxlen=1000)   # of recent successful requests
+        self.executor = hedge and concurrent.futures.ThreadPoolExecutor(32) or None
+        self.nodes = [Node(tuple(addr), timeout) for addr in addresses]
+        ring = sorted([(hash_key("%s:%d#%d" % (node.addr + (i,))), node)
+                       for node in self.nodes for i in range(replicas)], key=lambda point: point[0])
+        self.ring_keys = [key for key, node in ring]
+        self.ring_nodes = [node for key, node in ring]
+        if check_interval:
+            checker = threading.Thread(target=self._check, args=(check_interval,))
+            checker.daemon = True
+            checker.start()
+
+    def _check(self, interval):
+        """ Health checker thread """
+        while True:
+            time.sleep(interval)
+            for node in self.nodes:
+                try:
+                    node.proxy().stats()
+                    node.healthy = True
+                except jsonrpc.RPCFault:
+                    node.healthy = True   # answers, if only with an error
+                except Exception:
+                    node.healthy = False
+
+    def candidates(self, text):
+        """ The healthy servers to try for text, best first """
+        if self.strategy == "hash":
+            nodes = []
+            start = bisect.bisect(self.ring_keys, hash_key(text))
+            for i in range(len(self.ring_nodes)):
+                node = self.ring_nodes[(start + i) % len(self.ring_nodes)]
+                if node not in nodes:
+                    nodes.append(node)
+                    if len(nodes) == len(self.nodes):
+                        break
+        else:
+            nodes = sorted(self.nodes, key=lambda node: node.outstanding)
+        return [node for node in nodes if node.healthy]
+
+    def hedge_delay(self):
+        """ Seconds after which a request is hedged, None if it isn't (yet) """
+        if not self.hedge or len(self.latencies) < 20:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(self.hedge * len(latencies)))]
+
+    def _send(self, node, method, text, args, deadline):
+        """ One request to one server; the time left until the deadline is its last argument """
+        timeout = None
+        if deadline is not None:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                raise jsonrpc.RPCDeadlineExceeded("deadline passed on the client")
+            args = args + (timeout,)
+        with node.lock:
+            node.outstanding += 1
+        start_time = time.time()
+        try:
+            result = getattr(node.proxy(timeout), method)(text, *args)
+        except jsonrpc.RPCTimeoutError:
+            raise   # slow, not down
+        except jsonrpc.RPCTransportError:
+            node.healthy = False
+            raise
+        finally:
+            with node.lock:
+                node.outstanding -= 1
+        self.latencies.append(time.time() - start_time)
+        return result
+
+    def _request(self, nodes, method, text, args, deadline):
+        """ Sends the request to nodes[0], and hedges it to nodes[1] if it is slow """
+        delay = self.hedge_delay()
+        if delay is None or len(nodes) < 2:
+            return self._send(nodes[0], method, text, args, deadline)
+        first = self.executor.submit(self._send, nodes[0], method, text, args, deadline)
+        try:
+            return first.result(delay)
+        except concurrent.futures.TimeoutError:
+            if not self.budget.withdraw():
+                return first.result()
+        pending = set([first, self.executor.submit(self._send, nodes[1], method, text, args, deadline)])
+        while True:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None or not pending:
+                    return future.result()
+
+    def call(self, method, text, *args, deadline=None):
+        """
+        Calls method(text, *args) on the first server that answers, see
+        above.  With a deadline (as in time.time()), the time left is
+        passed as the method's last argument.
+        """
+        self.budget.deposit()
+        nodes = self.candidates(text) or list(self.nodes)
+        errors = []
+        for attempt in range(self.retries + 1):
+            if attempt:
+                delay = backoff(attempt, self.backoff, self.max_backoff)
+                if deadline is not None and time.time() + delay >= deadline:
+                    break
+                if not self.budget.withdraw():
+                    errors.append("retry budget exhausted")
+                    break
+                time.sleep(delay)
+            i = attempt % len(nodes)
+            try:
+                return self._request(nodes[i:] + nodes[:i], method, text, args, deadline)
+            except (jsonrpc.RPCTransportError, jsonrpc.RPCServerBusy) as e:
+                errors.append("%r: %s" % (nodes[i], e))
+        raise jsonrpc.RPCTransportError("no server could handle the request (%s)" % "; ".join(errors))
+
+    def parse(self, text, timeout=None):
+        """ The parse of text, or RPCError if not done within `timeout` (default: `deadline`) seconds """
+        timeout = timeout or self.deadline
+        return json.loads(self.call("parse", text, deadline=timeout and time.time() + timeout))
+
+
+if __name__ == '__main__':
+    nlp = StanfordNLP()
+    result = nlp.parse("Hello world!  It is so beautiful.")
+    pprint(result)
+
+    sentence = result['sentences'][0]
+    for np in trees.constituents(sentence, 'NP'):
+        print(' '.join(trees.words(sentence, np)))
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+#
+# coreference  - normalized coreference chains
+# Copyright (c) 2014 Dustin Smith
+#   https://github.com/dasmith/stanford-corenlp-python
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+Coreference as a table of mentions instead of pairs.  'coref' lists
+each set as (mention, representative) pairs, repeating the representative
+in every pair.  The index lists every mention once:
+
+  mentions        [sentence, head, start, end, text, chain] per mention,
+                  with 0-based indices and the tokens start..end-1, the
+                  representative of each chain first
+
+A server started with --coref-index returns this instead of 'coref'.
+The functions below take such results and otherwise build the index
+from 'coref' on first use, and add the lookup tables
+
+  chains          the mentions of each chain, the representative first
+  token_mentions  (in each sentence) the innermost mention containing
+                  each token, or None
+
+which aren't sent, as they only repeat what 'mentions' says:
+
+    coreference.resolve(results, 1, 0)   # "It" -> "Stanford University"
+"""
+
+SENTENCE, HEAD, START, END, TEXT, CHAIN = range(6)
+
+
+def build(coref):
+    """ The mentions of the coreference sets in 'coref' """
+    mentions, ids = [], set()
+    def add(mention, chain):
+        text, sentence, head, start, end = mention
+        key = (sentence, start, end)
+        if key not in ids:
+            ids.add(key)
+            mentions.append([sentence, head, start, end, text, chain])
+    for chain, pairs in enumerate(coref):
+        for mention, representative in pairs:
+            add(representative, chain)
+            add(mention, chain)
+    return mentions
+
+
+def chains(mentions):
+    """ The mentions of each chain, in order (so the representative first) """
+    result = []
+    for m, mention in enumerate(mentions):
+        while len(result) <= mention[CHAIN]:
+            result.append([])
+        result[mention[CHAIN]].append(m)
+    return result
+
+
+def token_mentions(sentences, mentions):
+    """ The token_mentions of each of the sentences """
+    tables = [[None] * len(sentence['words']) for sentence in sentences]
+    # the widest first, so the innermost mention of a token wins
+    for m in sorted(range(len(mentions)), key=lambda m: mentions[m][START] - mentions[m][END]):
+        sentence, head, start, end = mentions[m][:4]
+        if 0 <= sentence < len(tables):
+            tokens = tables[sentence]
+            for k in range(max(start, 0), min(end, len(tokens))):
+                tokens[k] = m
+    return tables
+
+
+def index(results):
+    """
+    Adds the index to the results of parse_parser_results (if they don't
+    have it yet) and returns them
+    """
+    if 'mentions' not in results:
+        results['mentions'] = build(results.get('coref', []))
+    return results
+
+
+def mention_at(results, i, k):
+    """ The innermost mention containing token k of sentence i, or None """
+    sentences = index(results)['sentences']
+    if 'token_mentions' not in sentences[i]:
+        for sentence, tokens in zip(sentences, token_mentions(sentences, results['mentions'])):
+            sentence['token_mentions'] = tokens
+    return sentences[i]['token_mentions'][k]
+
+
+def chain(results, m):
+    """ The mentions coreferent with mention m, the representative first """
+    if 'chains' not in index(results):
+        results['chains'] = chains(results['mentions'])
+    return results['chains'][results['mentions'][m][CHAIN]]
+
+
+def representative(results, m):
+    """ The representative mention of mention m's chain """
+    return chain(results, m)[0]
+
+
+def resolve(results, i, k):
+    """
+    The text of the representative mention that token k of sentence i
+    refers to, or None if it isn't part of a mention
+    """
+    m = mention_at(results, i, k)
+    if m is None:
+        return None
+    return results['mentions'][representative(results, m)][TEXT]
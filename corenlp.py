@@ -20,17 +20,40 @@
 
 import json
 import optparse
-import os, re, sys, time, traceback
-import jsonrpc, pexpect
-from progressbar import ProgressBar, Fraction
+import os, re, signal, sys, time, traceback
+import codecs, concurrent.futures, itertools, multiprocessing, queue, select, shlex, socket, subprocess, threading, uuid
+import jsonrpc
+import coreference, dependencies, metrics, store, trees
+from progressbar import ProgressBar, ProgressBarWidget, Fraction, Bar, ETA
 import logging
 
 
 VERBOSE = True
 
 STATE_START, STATE_TEXT, STATE_WORDS, STATE_TREE, STATE_DEPENDENCY, STATE_COREFERENCE = 0, 1, 2, 3, 4, 5
-WORD_PATTERN = re.compile('\[([^\]]+)\]')
-CR_PATTERN = re.compile(r"\((\d*),(\d)*,\[(\d*),(\d*)\]\) -> \((\d*),(\d)*,\[(\d*),(\d*)\]\), that is: \"(.*)\" -> \"(.*)\"")
+# the shell's prompt, which ends every output
+PROMPT = "\nNLP> "
+# the output is read in chunks of READ_SIZE bytes, doubling up to MAX_READ_SIZE
+READ_SIZE, MAX_READ_SIZE = 4096, 1 << 20
+# seconds to wait for a backend's greeting
+ATTACH_TIMEOUT = 60
+WORD_PATTERN = re.compile(r'\[([^\]]+)\]')
+CR_PATTERN = re.compile(r"\((\d+),(\d+),\[(\d+),(\d+)\]\) -> \((\d+),(\d+),\[(\d+),(\d+)\]\), that is: \"(.*)\" -> \"(.*)\"")
+
+
+def max_expected_time(text):
+    """
+    How much time should we give the parser to parse the text?  The
+    timeout increases as a function of the text's length; anything
+    longer than 5 seconds requires that you also increase timeout=5 in
+    jsonrpc.py.
+    """
+    return min(40, 3 + len(text) / 20.0)
+
+
+class ProcessTimeout(Exception):
+    """ CoreNLP didn't answer in time """
+
 
 # initialize logger
 logging.basicConfig(level=logging.INFO)
@@ -38,7 +61,11 @@ logger = logging.getLogger(__name__)
 
 
 def remove_id(word):
-    """Removes the numeric suffix from the parsed recognized words: e.g. 'word-2' > 'word' """
+    """
+    Removes the numeric suffix from the parsed recognized words: e.g. 'word-2' > 'word'
+    No longer used here (dependencies.parse_dependency strips the
+    indices itself); kept for scripts importing it from this module.
+    """
     return word.count("-") == 0 and word or word[0:word.rindex("-")]
 
 
@@ -64,19 +91,52 @@ def parse_bracketed(s):
     return (word, attrs)
 
 
-def parse_parser_results(text):
+def parse_coreference(line):
+    """
+    Reads a line of a coreference set, like
+    (2,1,[1,2]) -> (1,2,[1,3]), that is: "It" -> "Stanford University"
+    into a (mention, representative) pair of (text, sentence, head, start,
+    end) tuples with 0-based indices.  Returns None for other lines.
+    """
+    m = CR_PATTERN.match(line)
+    if m is None:
+        return None
+    src_i, src_pos, src_l, src_r, sink_i, sink_pos, sink_l, sink_r, src_word, sink_word = m.groups()
+    return ((src_word, int(src_i) - 1, int(src_pos) - 1, int(src_l) - 1, int(src_r) - 1),
+            (sink_word, int(sink_i) - 1, int(sink_pos) - 1, int(sink_l) - 1, int(sink_r) - 1))
+
+
+def iter_lines(text):
+    """ The lines of text one at a time, rather than all copied at once """
+    start = 0
+    end = text.find("\n")
+    while end >= 0:
+        yield text[start:end]
+        start = end + 1
+        end = text.find("\n", start)
+    yield text[start:]
+
+
+def parse_parser_results(text, tree=False, coref_index=False):
     """ This is the nasty bit of code to interact with the command-line
     interface of the CoreNLP tools.  Takes a string of the parser results
     and then returns a Python list of dictionaries, one for each parsed
-    sentence.
+    sentence.  With tree=True, sentences also get their parse tree in the
+    array encoding of trees.py, and with coref_index=True 'coref' is
+    replaced by the mention index of coreference.py.
+    
+    The strings of the results are text (not bytes), like the output as
+    read from CoreNLP, so character offsets index into them correctly.
     """
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
     results = {"sentences": []}
     state = STATE_START
-    for line in text.encode('utf-8').split("\n"):
+    for line in iter_lines(text):
         line = line.strip()
         
         if line.startswith("Sentence #"):
-            sentence = {'words':[], 'parsetree':[], 'dependencies':[]}
+            sentence = {'words':[], 'parsetree':[], 'dependencies':[], 'indexed_dependencies':[]}
             results["sentences"].append(sentence)
             state = STATE_TEXT
         
@@ -95,6 +155,8 @@ def parse_parser_results(text):
             if len(line) == 0:
                 state = STATE_DEPENDENCY
                 sentence['parsetree'] = " ".join(sentence['parsetree'])
+                if tree:
+                    sentence['tree'] = trees.encode(sentence['parsetree'])
             else:
                 sentence['parsetree'].append(line)
         
@@ -102,10 +164,11 @@ def parse_parser_results(text):
             if len(line) == 0:
                 state = STATE_COREFERENCE
             else:
-                split_entry = re.split("\(|, ", line[:-1])
-                if len(split_entry) == 3:
-                    rel, left, right = map(lambda x: remove_id(x), split_entry)
-                    sentence['dependencies'].append(tuple([rel,left,right]))
+                dependency = dependencies.parse_dependency(line)
+                if dependency is not None:
+                    rel, left, left_i, right, right_i = dependency
+                    sentence['dependencies'].append((rel, left, right))
+                    sentence['indexed_dependencies'].append((rel, left_i, right_i))
         
         elif state == STATE_COREFERENCE:
             if "Coreference set" in line:
@@ -114,116 +177,260 @@ def parse_parser_results(text):
                 coref_set = []
                 results['coref'].append(coref_set)
             else:
-                for src_i, src_pos, src_l, src_r, sink_i, sink_pos, sink_l, sink_r, src_word, sink_word in CR_PATTERN.findall(line):
-                    src_i, src_pos, src_l, src_r = int(src_i)-1, int(src_pos)-1, int(src_l)-1, int(src_r)-1
-                    sink_i, sink_pos, sink_l, sink_r = int(sink_i)-1, int(sink_pos)-1, int(sink_l)-1, int(sink_r)-1
-                    coref_set.append(((src_word, src_i, src_pos, src_l, src_r), (sink_word, sink_i, sink_pos, sink_l, sink_r)))
+                pair = parse_coreference(line)
+                if pair is not None:
+                    coref_set.append(pair)
     
+    for sentence in results["sentences"]:
+        sentence.update(dependencies.index(sentence['indexed_dependencies'], len(sentence['words'])))
+    if coref_index:
+        coreference.index(results)
+        results.pop('coref', None)
     return results
 
 
+def postprocess(incoming, tree=False, coref_index=False):
+    """
+    parse_parser_results() in JSON: what a StanfordCoreNLPPool with
+    `processes` runs in its process pool
+    """
+    return json.dumps(parse_parser_results(incoming, tree, coref_index))
+
+
+def java_command(corenlp_path=None):
+    """
+    Checks the location of the jar files and returns the command line
+    that starts CoreNLP's interactive shell.
+    """
+    jars = ["stanford-corenlp-3.4.1.jar",
+            "stanford-corenlp-3.4.1-models.jar",
+            "joda-time.jar",
+            "xom.jar",
+            "jollyday.jar"]
+   
+    # if CoreNLP libraries are in a different directory,
+    # change the corenlp_path variable to point to them
+    if not corenlp_path:
+        corenlp_path = "./stanford-corenlp-full-2014-08-27/"
+    
+    java_path = "java"
+    classname = "edu.stanford.nlp.pipeline.StanfordCoreNLP"
+    # include the properties file, so you can change defaults
+    # but any changes in output format will break parse_parser_results()
+    props = "-props default.properties" 
+    
+    # add and check classpaths
+    jars = [corenlp_path + jar for jar in jars]
+    for jar in jars:
+        if not os.path.exists(jar):
+            logger.error("Error! Cannot locate %s" % jar)
+            sys.exit(1)
+    
+    return "%s -Xmx1800m -cp %s %s %s" % (java_path, ':'.join(jars), classname, props)
+
+
 class StanfordCoreNLP(object):
     """
     Command-line interaction with Stanford's CoreNLP java utilities.
     Can be run as a JSON-RPC server or imported as a module.
     """
-    def __init__(self, corenlp_path=None):
-        """
-        Checks the location of the jar files.
-        Spawns the server as a process.
-        """
-        jars = ["stanford-corenlp-3.4.1.jar",
-                "stanford-corenlp-3.4.1-models.jar",
-                "joda-time.jar",
-                "xom.jar",
-                "jollyday.jar"]
-       
-        # if CoreNLP libraries are in a different directory,
-        # change the corenlp_path variable to point to them
-        if not corenlp_path:
-            corenlp_path = "./stanford-corenlp-full-2014-08-27/"
-        
-        java_path = "java"
-        classname = "edu.stanford.nlp.pipeline.StanfordCoreNLP"
-        # include the properties file, so you can change defaults
-        # but any changes in output format will break parse_parser_results()
-        props = "-props default.properties" 
-        
-        # add and check classpaths
-        jars = [corenlp_path + jar for jar in jars]
-        for jar in jars:
-            if not os.path.exists(jar):
-                logger.error("Error! Cannot locate %s" % jar)
-                sys.exit(1)
+    def __init__(self, corenlp_path=None, command=None, tree=False, coref_index=False, attach=None):
+        """
+        Spawns the server as a process: CoreNLP from the jar files in
+        corenlp_path, or any `command` line behaving like its interactive
+        shell (e.g. the stand-in in bench/fake_corenlp.py).  `tree` and
+        `coref_index` choose extra output (see parse_parser_results).
         
-        # spawn the server
-        start_corenlp = "%s -Xmx1800m -cp %s %s %s" % (java_path, ':'.join(jars), classname, props)
+        With `attach`, the path of a Backend's socket, it uses the
+        backend's running processes instead, whose models are loaded
+        already.
+        """
+        self.tree = tree
+        self.coref_index = coref_index
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self.buffer = ""
+        self.desynced = False
+        if attach is not None:
+            self.corenlp = None
+            self.pid = None
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(attach)
+            self.fd = self.sock.fileno()
+            # the backend greets with the prompt
+            self._expect(re.escape(PROMPT.lstrip()), timeout=ATTACH_TIMEOUT)
+            return
+        if command is None:
+            command = java_command(corenlp_path)
         if VERBOSE: 
-            logger.debug(start_corenlp)
-        self.corenlp = pexpect.spawn(start_corenlp)
+            logger.debug(command)
         
+        # spawn the server, talking to it over pipes in UTF-8
+        self.corenlp = subprocess.Popen(shlex.split(command), stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self.fd = self.corenlp.stdout.fileno()
+        self.pid = self.corenlp.pid
+        try:
+            self._load()
+        except BaseException:
+            # don't leave a half-loaded JVM behind
+            self.corenlp.kill()
+            self.corenlp.wait()
+            self.corenlp.stdin.close()
+            self.corenlp.stdout.close()
+            raise
+    
+    def _load(self):
+        """ Waits until CoreNLP has loaded its models and shows the prompt """
         # show progress bar while loading the models
         widgets = ['Loading Models: ', Fraction()]
         pbar = ProgressBar(widgets=widgets, maxval=5, force_update=True).start()
-        self.corenlp.expect("done.", timeout=20) # Load pos tagger model (~5sec)
+        self._expect("done.", timeout=20) # Load pos tagger model (~5sec)
         pbar.update(1)
-        self.corenlp.expect("done.", timeout=200) # Load NER-all classifier (~33sec)
+        self._expect("done.", timeout=200) # Load NER-all classifier (~33sec)
         pbar.update(2)
-        self.corenlp.expect("done.", timeout=600) # Load NER-muc classifier (~60sec)
+        self._expect("done.", timeout=600) # Load NER-muc classifier (~60sec)
         pbar.update(3)
-        self.corenlp.expect("done.", timeout=600) # Load CoNLL classifier (~50sec)
+        self._expect("done.", timeout=600) # Load CoNLL classifier (~50sec)
         pbar.update(4)
-        self.corenlp.expect("done.", timeout=200) # Loading PCFG (~3sec)
+        self._expect("done.", timeout=200) # Loading PCFG (~3sec)
         pbar.update(5)
-        self.corenlp.expect("Entering interactive shell.")
+        self._expect("Entering interactive shell.", timeout=30)
         pbar.finish()
+        
+        # every output ends with the prompt, so after reading up to it
+        # nothing is left over for the next request
+        self._expect(re.escape(PROMPT.lstrip()), timeout=30)
     
-    def _parse(self, text):
+    def _read(self, size, timeout):
         """
-        This is the core interaction with the parser.
-        
-        It returns a Python data-structure, while the parse()
-        function returns a JSON object
+        Reads and decodes at most size bytes of output, waiting up to
+        timeout seconds for some.  Returns None on timeout and raises
+        EOFError once the process closed its output.
         """
-        # clean up anything leftover
-        while True:
-            try:
-                self.corenlp.read_nonblocking (4000, 0.3)
-            except pexpect.TIMEOUT:
-                break
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return None
+        data = os.read(self.fd, size)
+        if not data:
+            raise EOFError("CoreNLP exited")
+        self.read_size = len(data)   # in bytes, unlike the decoded result
+        return self.decoder.decode(data)
+    
+    def _expect(self, pattern, timeout):
+        """
+        Reads the output up to and including the first match of the regular
+        expression pattern, keeping whatever follows it for the next read.
+        Raises ProcessTimeout if there is none within timeout seconds.
+        """
+        end_time = time.time() + timeout
+        pattern = re.compile(pattern)
+        match = pattern.search(self.buffer)
+        while match is None:
+            chunk = self._read(READ_SIZE, max(0, end_time - time.time()))
+            if chunk is None:
+                raise ProcessTimeout("no %r after %s seconds" % (pattern.pattern, timeout))
+            self.buffer += chunk
+            match = pattern.search(self.buffer)
+        before, self.buffer = self.buffer[:match.start()], self.buffer[match.end():]
+        return before
+    
+    def _send(self, data):
+        """ Writes bytes to CoreNLP's input """
+        if self.corenlp is None:
+            self.sock.sendall(data)
+        else:
+            self.corenlp.stdin.write(data)
+            self.corenlp.stdin.flush()
+    
+    def close(self):
+        """ Stops the CoreNLP process, or detaches from the backend """
+        if self.corenlp is None:
+            self.sock.close()
+            return
+        try:
+            self.corenlp.stdin.close()
+        except OSError:
+            pass   # the process is gone already
+        try:
+            self.corenlp.wait(5)
+        except subprocess.TimeoutExpired:
+            self.corenlp.kill()
+            self.corenlp.wait()
+        self.corenlp.stdout.close()
+    
+    def _communicate(self, text):
+        """
+        This is the core interaction with the parser: sends the text and
+        returns CoreNLP's output for it, or None if it timed out.  Raises
+        EOFError if the process exits (or the backend hangs up) before
+        the output is complete.
+        """
+        if isinstance(text, bytes):
+            text = text.decode('utf-8')
+        # the shell parses one line per document
+        text = text.replace("\r", " ").replace("\n", " ")
+        # an empty line is answered with a bare prompt, and "q" quits
+        if not text.strip():
+            return ""
+        if text.strip().lower() == "q":
+            raise jsonrpc.RPCInvalidParamValues("%r would quit CoreNLP's shell" % text)
+        
+        # a timed out request's output is still on its way: skip it
+        if self.desynced:
+            with metrics.REGISTRY.timer('drain'):
+                try:
+                    self._expect(re.escape(PROMPT), timeout=40)
+                except ProcessTimeout:
+                    logger.error("Error: No prompt after a timed out request")
+            self.desynced = False
         
-        self.corenlp.sendline(text)
+        self._send((text + "\n").encode('utf-8'))
+        end_time = time.time() + max_expected_time(text)
         
-        # How much time should we give the parser to parse it?
-        # the idea here is that you increase the timeout as a 
-        # function of the text's length.
-        # anything longer than 5 seconds requires that you also
-        # increase timeout=5 in jsonrpc.py
-        max_expected_time = min(40, 3 + len(text) / 20.0)
-        end_time = time.time() + max_expected_time
-
-        incoming = ""
+        # collect the chunks in a list and only look for the prompt in the
+        # newest chunk (and the end of the output before, in case the prompt
+        # is split), so reading stays linear in the size of the output
+        chunks = [self.buffer]
+        self.buffer = ""
+        size = READ_SIZE
+        tail = ""
         while True:
-            # Time left, read more data
-            try:
-                incoming += self.corenlp.read_nonblocking(2000, 1)
-                if "\nNLP>" in incoming: 
-                    break
-                time.sleep(0.0001)
-            except pexpect.TIMEOUT:
+            chunk = self._read(size, 1)
+            if chunk is None:
                 if end_time - time.time() < 0:
-                    logger.error("Error: Timeout with input '%s'" % (incoming))
-                    return {'error': "timed out after %f seconds" % max_expected_time}
+                    logger.error("Error: Timeout with input '%s'" % ("".join(chunks)))
+                    metrics.REGISTRY.incr('timeouts')
+                    self.desynced = True
+                    return None
                 else:
                     continue
-            except pexpect.EOF:
+            chunks.append(chunk)
+            if PROMPT in chunk or PROMPT in tail + chunk[:len(PROMPT)]:
                 break
-        
+            tail = (tail + chunk)[-len(PROMPT):]
+            if self.read_size == size:
+                size = min(2 * size, MAX_READ_SIZE)
+        incoming = "".join(chunks)
         if VERBOSE: 
             logger.debug("%s\n%s" % ('='*40, incoming))
+        return incoming
+    
+    def _parse(self, text):
+        """
+        Parses the text and returns a Python data-structure, while the
+        parse() function returns a JSON object
+        """
+        if isinstance(text, bytes):
+            text = text.decode('utf-8')
+        start_time = time.time()
+        incoming = self._communicate(text)
+        metrics.REGISTRY.observe('java_parse', time.time() - start_time)
+        if incoming is None:
+            return {'error': "timed out after %f seconds" % max_expected_time(text)}
         try:
-            results = parse_parser_results(incoming)
-        except Exception, e:
+            with metrics.REGISTRY.timer('parse_parser_results'):
+                results = parse_parser_results(incoming, self.tree, self.coref_index)
+        except Exception as e:
             if VERBOSE: 
                 logger.debug(traceback.format_exc())
             raise e
@@ -238,24 +445,996 @@ class StanfordCoreNLP(object):
         """
         response = self._parse(text)
         logger.debug("Response: '%s'" % (response))
-        return json.dumps(response)
+        with metrics.REGISTRY.timer('json_dumps'):
+            return json.dumps(response)
+
+
+# priority lanes of the job queue, the lower the sooner
+LANE_INTERACTIVE, LANE_BATCH = 0, 1
+
+
+class Job(object):
+    """
+    A text waiting in a StanfordCoreNLPPool's queue, and later its result.
+    """
+    def __init__(self, text, job_id=None, lane=LANE_INTERACTIVE, timeout=None):
+        self.text = text
+        self.job_id = job_id
+        self.lane = lane
+        self.deadline = timeout and time.time() + timeout or None
+        self.queued_at = None
+        self.result = None
+        self.json = None   # the result in JSON instead, if post-processed in a process pool
+        self.error = None
+        self.done = threading.Event()
+        self.finished_at = None
+        self.followers = []   # jobs for the same text, answered with this one's result
+    
+    def expired(self):
+        """ True if the job's deadline has passed """
+        return self.deadline is not None and self.deadline <= time.time()
+    
+    def finish(self):
+        """
+        Passes the result on to the followers and marks them all done.
+        They get it in JSON, so each decodes its own copy in wait().
+        """
+        if self.followers and self.error is None and self.json is None:
+            self.json = json.dumps(self.result)
+        self.finished_at = time.time()
+        for follower in self.followers:
+            follower.json, follower.error = self.json, self.error
+            follower.finished_at = self.finished_at
+            follower.done.set()
+        self.done.set()
+    
+    def join(self):
+        """
+        Blocks until the job is parsed, raising its error if it failed.
+        Gives up with RPCDeadlineExceeded once the deadline has passed.
+        """
+        if self.deadline is None:
+            self.done.wait()
+        elif not self.done.wait(max(0, self.deadline - time.time())):
+            raise jsonrpc.RPCDeadlineExceeded("not parsed within the deadline")
+        if self.error is not None:
+            raise self.error
+    
+    def wait(self):
+        """ Same as join(), returning the result """
+        self.join()
+        if self.result is None and self.json is not None:
+            self.result = json.loads(self.json)
+        return self.result
+    
+    def dumps(self):
+        """ The finished job's result in JSON, as returned by parse() """
+        if self.error is not None:
+            return json.dumps({'error': str(self.error)})
+        if self.json is not None:
+            return self.json
+        return json.dumps(self.result)
+
+
+class Worker(object):
+    """ A worker thread of a StanfordCoreNLPPool and its process """
+    def __init__(self, nlp):
+        self.nlp = nlp
+        self.thread = None
+        self.parsed = 0   # texts parsed so far
+        self.retired = False
+        self.exited = False   # its process is gone, so it takes no jobs
+        self.replacing = False
+        self.drift = metrics.Drift()   # of the seconds per 1000 characters
+        self.usage = None   # (rss, cpu seconds) of the process when last sampled
+        self.sampled_at = None
+        self.cpu_percent = None
+
+    def sample(self):
+        """ Updates the readings of the process' memory and CPU usage """
+        usage = self.nlp.pid and metrics.process_usage(self.nlp.pid)
+        now = time.time()
+        if usage and self.usage:
+            self.cpu_percent = 100 * (usage[1] - self.usage[1]) / (now - self.sampled_at)
+        self.usage = usage or None
+        self.sampled_at = now
+
+    def info(self):
+        return {'pid': self.nlp.pid,
+                'parsed': self.parsed,
+                'rss': self.usage and self.usage[0],
+                'cpu_percent': self.cpu_percent,
+                'latency_drift': self.drift.ratio()}
+
+
+class StanfordCoreNLPPool(object):
+    """
+    Several StanfordCoreNLP processes sharing one bounded queue of jobs,
+    so that concurrent (e.g. pipelined) requests are parsed as soon as
+    any of the processes is free.
+    
+    Besides the blocking parse(), texts can be queued with submit() and
+    their results collected later with fetch() or wait_any().  Submitted
+    texts wait in a batch lane that is only served when no parse() call
+    (interactive lane) is waiting.  Each lane admits at most `queue_size`
+    jobs; beyond that requests fail fast with RPCServerBusy, and jobs whose
+    deadline passed while queued are dropped, so latency stays bounded
+    under overload.
+    
+    With a `cache` (a store.Store), texts parsed before are answered from
+    disk without queueing.  A text that is already queued or being parsed
+    in the same lane (e.g. a client's retry) isn't queued again either: the
+    request waits for the same job instead.
+    
+    With `processes`, CoreNLP's output is turned into JSON (see
+    postprocess()) by a pool of that many Python processes rather than in
+    the worker threads, so this work isn't serialized by the GIL.
+    
+    Processes are replaced without dropping requests: a new one is
+    started and loads its models while the old one keeps parsing, and only
+    then the old one is retired, after its current job.  A process that
+    exits (or a backend connection that drops) fails its current job and
+    is replaced the same way.  reload() replaces
+    all of them (e.g. to apply a changed default.properties), and with
+    `recycle_after` each is replaced after parsing that many texts.
+    
+    Every `monitor_interval` seconds the memory and CPU usage of each
+    process is read from /proc, so that a JVM that grew to `max_rss` bytes
+    is replaced before it runs out of heap.  Likewise one whose parses
+    (per character) became `max_drift` times slower than its first ones,
+    as when it spends ever more time collecting garbage.  stats() reports
+    these readings for every worker.
+    """
+    def __init__(self, size=1, corenlp_path=None, queue_size=1000, timeout=None, command=None, cache=None,
+                 tree=False, coref_index=False, processes=0, attach=None, recycle_after=0,
+                 max_rss=0, max_drift=0, monitor_interval=10, result_ttl=3600):
+        """
+        Spawns `size` CoreNLP processes (see StanfordCoreNLP, also for
+        `tree` and `coref_index`), each served by a worker thread, and
+        `processes` post-processing processes (0 = none) -- or makes `size`
+        connections to a Backend listening at `attach`.  At most
+        `queue_size` jobs wait in each lane (0 = no limit), and parse()
+        requests without a timeout of their own get `timeout`.  Submitted
+        results not fetched within `result_ttl` seconds after they are
+        finished are dropped (0 = kept until fetched).
+        """
+        self.nlp_args = (corenlp_path, command, tree, coref_index, attach)
+        self.recycle_after = recycle_after
+        self.max_rss = max_rss
+        self.max_drift = max_drift
+        self.replacing = threading.Lock()   # one new process at a time
+        self.closing = False
+        self.cache = cache
+        self.executor = None
+        if processes:
+            # spawned, not forked from a process running threads
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                processes, mp_context=multiprocessing.get_context('spawn'))
+        self.queue = queue.PriorityQueue()
+        self.queue_size = queue_size
+        self.depth = {LANE_INTERACTIVE: 0, LANE_BATCH: 0}
+        self.seq = itertools.count()   # keeps each lane first-in first-out
+        self.timeout = timeout
+        self.jobs = {}   # submitted jobs by id, until fetched
+        self.result_ttl = result_ttl
+        self.inflight = {}   # (lane, text) -> its queued or running job
+        self.finished = threading.Condition()
+        self.workers = []
+        self.busy = 0   # workers currently parsing
+        metrics.REGISTRY.gauge('queue_depth_interactive', lambda: self.depth[LANE_INTERACTIVE])
+        metrics.REGISTRY.gauge('queue_depth_batch', lambda: self.depth[LANE_BATCH])
+        metrics.REGISTRY.gauge('jobs_unfetched', lambda: len(self.jobs))
+        metrics.REGISTRY.gauge('workers', lambda: len(self.workers))
+        metrics.REGISTRY.gauge('workers_busy', lambda: self.busy)
+        metrics.REGISTRY.gauge('worker_rss_max', lambda: max(
+            [w.usage[0] for w in self.workers if w.usage] or [0]))
+        metrics.REGISTRY.gauge('worker_latency_drift_max', lambda: max(
+            [w.drift.ratio() or 0 for w in self.workers] or [0]))
+        metrics.REGISTRY.incr('worker_restarts', 0)
+        metrics.REGISTRY.incr('recycled_memory', 0)
+        metrics.REGISTRY.incr('recycled_latency', 0)
+        metrics.REGISTRY.incr('coalesced', 0)
+        metrics.REGISTRY.incr('results_expired', 0)
+        for i in range(size):
+            self._start(Worker(StanfordCoreNLP(*self.nlp_args)))
+        if monitor_interval:
+            thread = threading.Thread(target=self._monitor, args=(monitor_interval,))
+            thread.daemon = True
+            thread.start()
+    
+    def _start(self, worker):
+        """ Starts the worker's thread """
+        worker.thread = threading.Thread(target=self._work, args=(worker,))
+        worker.thread.daemon = True
+        worker.thread.start()
+        with self.finished:
+            self.workers.append(worker)
+    
+    def _work(self, worker):
+        """
+        Worker thread: parses queued jobs with its own process, until it
+        is retired
+        """
+        nlp = worker.nlp
+        while not worker.retired:
+            if worker.exited:
+                time.sleep(1)   # until its successor retires it
+                continue
+            try:
+                priority, seq, job = self.queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            with self.finished:
+                self.depth[job.lane] -= 1
+                self.busy += 1
+                # dropped only if none of the requests waiting for it can still use it
+                expired = job.expired() and all(follower.expired() for follower in job.followers)
+                if expired:
+                    del self.inflight[job.lane, job.text]
+            metrics.REGISTRY.observe('queue_wait', time.time() - job.queued_at)
+            if expired:
+                metrics.REGISTRY.incr('deadline_exceeded')
+                job.error = jsonrpc.RPCDeadlineExceeded("deadline passed while queued")
+            else:
+                start_time = time.time()
+                try:
+                    if self.executor is None:
+                        job.result = metrics.PROFILER.call(nlp._parse, job.text)
+                    else:
+                        metrics.PROFILER.call(self._postprocess, nlp, job)
+                    if self.cache is not None:
+                        if job.result is None:
+                            job.result = json.loads(job.json)
+                        if 'error' not in job.result:
+                            self.cache.put(self._cache_key(job.text), job.result)
+                    if job.result is None or 'error' not in job.result:
+                        worker.drift.observe((time.time() - start_time) / (1 + len(job.text) / 1000.0))
+                except (EOFError, OSError) as e:
+                    # the process exited (or the backend hung up): no more jobs for it
+                    logger.error("Error: CoreNLP process %s is gone (%s), replacing it" % (nlp.pid, e))
+                    metrics.REGISTRY.incr('errors')
+                    job.error = e
+                    worker.exited = True
+                except Exception as e:
+                    metrics.REGISTRY.incr('errors')
+                    job.error = e
+                worker.parsed += 1
+            with self.finished:
+                self.busy -= 1
+                if self.inflight.get((job.lane, job.text)) is job:
+                    del self.inflight[job.lane, job.text]
+                job.finish()
+                self.finished.notify_all()
+            if worker.exited or self.recycle_after and worker.parsed == self.recycle_after:
+                self.replace([worker])
+        with self.finished:
+            self.workers.remove(worker)
+        nlp.close()
+    
+    def replace(self, workers):
+        """
+        Replaces the processes of the workers one after the other, in the
+        background: each worker is retired once its successor is ready
+        """
+        with self.finished:
+            # not twice, if one is due for several reasons
+            workers = [worker for worker in workers if not worker.replacing]
+            for worker in workers:
+                worker.replacing = True
+        thread = threading.Thread(target=self._replace, args=(workers,))
+        thread.daemon = True
+        thread.start()
+    
+    def _replace(self, workers):
+        """ Replacement thread """
+        with self.replacing:
+            for worker in workers:
+                if worker.retired or self.closing:
+                    continue
+                try:
+                    successor = Worker(StanfordCoreNLP(*self.nlp_args))
+                except Exception as e:
+                    logger.error("Error: Could not start a new CoreNLP process: %s" % e)
+                    worker.replacing = False
+                    continue
+                if self.closing:
+                    successor.nlp.close()
+                    continue
+                self._start(successor)
+                worker.retired = True
+                metrics.REGISTRY.incr('worker_restarts')
+    
+    def _monitor(self, interval):
+        """
+        Monitor thread: samples the processes and replaces those that
+        exited or are past max_rss or max_drift
+        """
+        while not self.closing:
+            time.sleep(interval)
+            with self.finished:
+                workers = list(self.workers)
+            for worker in workers:
+                worker.sample()
+                if worker.retired or worker.replacing:
+                    continue
+                drift = worker.drift.ratio()
+                if worker.exited or worker.nlp.corenlp is not None and worker.nlp.corenlp.poll() is not None:
+                    # e.g. killed by the OOM killer: its zombie reads as 0 bytes
+                    logger.info("Replacing CoreNLP process %s, which exited" % worker.nlp.pid)
+                    worker.exited = True
+                elif self.max_rss and worker.usage and worker.usage[0] > self.max_rss:
+                    logger.info("Replacing CoreNLP process %d, using %d MB" % (
+                        worker.nlp.pid, worker.usage[0] >> 20))
+                    metrics.REGISTRY.incr('recycled_memory')
+                elif self.max_drift and drift and drift > self.max_drift:
+                    logger.info("Replacing CoreNLP process %s, parsing %.1f times slower" % (
+                        worker.nlp.pid, drift))
+                    metrics.REGISTRY.incr('recycled_latency')
+                else:
+                    continue
+                self.replace([worker])
+    
+    def reload(self):
+        """
+        Replaces all processes, so that they load the models and
+        default.properties anew, without interrupting the service
+        """
+        logger.info("Replacing %d CoreNLP processes" % len(self.workers))
+        self.replace(list(self.workers))
+    
+    def close(self):
+        """
+        Retires all workers and waits until they have finished their
+        current jobs and stopped their processes
+        """
+        self.closing = True
+        with self.finished:
+            workers = list(self.workers)
+        for worker in workers:
+            worker.retired = True
+        for worker in workers:
+            worker.thread.join()
+        if self.executor is not None:
+            self.executor.shutdown()
+    
+    def _postprocess(self, nlp, job):
+        """
+        Parses the job's text with nlp, leaving the output to the process
+        pool, which sets job.json
+        """
+        start_time = time.time()
+        incoming = nlp._communicate(job.text)
+        metrics.REGISTRY.observe('java_parse', time.time() - start_time)
+        if incoming is None:
+            job.result = {'error': "timed out after %f seconds" % max_expected_time(job.text)}
+            return
+        with metrics.REGISTRY.timer('postprocess'):
+            job.json = self.executor.submit(postprocess, incoming, nlp.tree, nlp.coref_index).result()
+    
+    def _enqueue(self, job):
+        """
+        Admits the job to its lane, or raises RPCServerBusy if full.  If
+        the same text is queued or parsed already, the job follows that one.
+        """
+        with self.finished:
+            leader = self.inflight.get((job.lane, job.text))
+            if leader is not None:
+                metrics.REGISTRY.incr('requests')
+                metrics.REGISTRY.incr('coalesced')
+                job.queued_at = time.time()
+                leader.followers.append(job)
+                return
+            if self.queue_size and self.depth[job.lane] >= self.queue_size:
+                metrics.REGISTRY.incr('rejected')
+                raise jsonrpc.RPCServerBusy("%d jobs queued" % self.depth[job.lane])
+            metrics.REGISTRY.incr('requests')
+            self.depth[job.lane] += 1
+            job.queued_at = time.time()
+            self.inflight[job.lane, job.text] = job
+            self.queue.put((job.lane, next(self.seq), job))
+    
+    def _cache_key(self, text):
+        """ The key of the text's result, which also depends on the output options """
+        corenlp_path, command, tree, coref_index, attach = self.nlp_args
+        return store.text_key(text, [option for option, on in
+                                     (('tree', tree), ('coref_index', coref_index)) if on])
+    
+    def _cached(self, job):
+        """
+        Sets the job's result from the cache, if there, and returns
+        whether it was.  It is kept in the stored JSON, so wait() only
+        decodes it for those who want the Python data-structure.
+        """
+        if self.cache is None:
+            return False
+        data = self.cache.get_raw(self._cache_key(job.text))
+        metrics.REGISTRY.incr(data is None and 'cache_misses' or 'cache_hits')
+        if data is None:
+            return False
+        job.json = data.decode('utf-8')
+        return True
+    
+    def _run(self, text, timeout=None):
+        """ Queues the text and returns its job once it is parsed """
+        job = Job(text, timeout=timeout or self.timeout)
+        if self._cached(job):
+            job.done.set()
+        else:
+            self._enqueue(job)
+        job.join()
+        return job
+    
+    def _parse(self, text, timeout=None):
+        """ Queues the text and waits for the Python data-structure """
+        return self._run(text, timeout).wait()
+    
+    def parse(self, text, timeout=None):
+        """
+        Same as StanfordCoreNLP.parse(), on the next free process.
+        Fails with RPCDeadlineExceeded if not done within `timeout` seconds.
+        """
+        job = self._run(text, timeout)
+        with metrics.REGISTRY.timer('json_dumps'):
+            response = job.dumps()
+        logger.debug("Response: '%s'" % (response))
+        return response
+    
+    def submit(self, text, job_id=None, timeout=None):
+        """
+        Queues the text in the batch lane without waiting for it to be
+        parsed and returns the id under which fetch() and wait_any()
+        report the result.  A client-chosen `job_id` allows submitting via
+        notification.  Raises RPCServerBusy instead of blocking if the
+        lane is full -- counting results that weren't fetched yet, which
+        the server keeps until then; a job still queued after `timeout`
+        seconds is dropped.
+        """
+        if job_id is None:
+            job_id = uuid.uuid4().hex
+        job = Job(text, job_id, LANE_BATCH, timeout)
+        cached = self._cached(job)
+        with self.finished:
+            self._expire()
+            if job_id in self.jobs:
+                raise jsonrpc.RPCInvalidParamValues("duplicate job id %r" % job_id)
+            if self.queue_size and len(self.jobs) >= self.queue_size:
+                metrics.REGISTRY.incr('rejected')
+                raise jsonrpc.RPCServerBusy("%d jobs submitted and not fetched" % len(self.jobs))
+            if cached:
+                job.finished_at = time.time()
+                job.done.set()
+                self.finished.notify_all()
+            else:
+                self._enqueue(job)
+            self.jobs[job_id] = job
+        return job_id
+    
+    def _expire(self):
+        """
+        Drops the results that weren't fetched within result_ttl seconds,
+        e.g. of a batch client that crashed, so they don't fill the lane
+        for good.  Call with self.finished held.
+        """
+        if not self.result_ttl:
+            return
+        end_time = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.finished_at is not None and job.finished_at < end_time]
+        for job_id in expired:
+            del self.jobs[job_id]
+        if expired:
+            logger.info("Dropped %d results not fetched within %d seconds" % (len(expired), self.result_ttl))
+            metrics.REGISTRY.incr('results_expired', len(expired))
+    
+    def fetch(self, job_ids):
+        """
+        Returns {job_id: result} for those of the jobs that are finished,
+        in the same JSON format as parse().  Fetched jobs are forgotten;
+        unfinished or unknown ids are left out.
+        """
+        results = {}
+        with self.finished:
+            for job_id in job_ids:
+                job = self.jobs.get(job_id)
+                if job is not None and job.done.is_set():
+                    results[job_id] = job.dumps()
+                    del self.jobs[job_id]
+        return results
+    
+    def wait_any(self, job_ids, timeout=None):
+        """
+        Like fetch(), but first waits (at most `timeout` seconds) until
+        at least one of the jobs is finished.
+        """
+        if timeout is not None:
+            end_time = time.time() + timeout
+        with self.finished:
+            while True:
+                jobs = [self.jobs[j] for j in job_ids if j in self.jobs]
+                if not jobs or any(job.done.is_set() for job in jobs):
+                    break
+                if timeout is None:
+                    self.finished.wait()
+                elif end_time <= time.time():
+                    break
+                else:
+                    self.finished.wait(end_time - time.time())
+            return self.fetch(job_ids)
+    
+    def stats(self):
+        """
+        Counters, gauges (queue depths, busy workers, ...) and per-stage
+        latency histograms of this server, and the memory, CPU and latency
+        readings of each worker's process
+        """
+        with self.finished:
+            self._expire()
+        stats = metrics.REGISTRY.snapshot()
+        with self.finished:
+            stats['workers'] = [worker.info() for worker in self.workers]
+        return stats
+    
+    def profile(self, enabled=True):
+        """
+        Turns profiling of parse requests (see metrics.Profiler) on or off
+        """
+        metrics.PROFILER.enabled = enabled
+        return {'enabled': enabled, 'requests': metrics.PROFILER.requests}
+    
+    def profile_dump(self, reset=False):
+        """
+        Writes the profile aggregated so far to a .prof file on the server
+        and returns its path with a summary of the most expensive calls.
+        """
+        result = {'path': metrics.PROFILER.dump(),
+                  'requests': metrics.PROFILER.requests,
+                  'summary': metrics.PROFILER.summary()}
+        if reset:
+            metrics.PROFILER.reset()
+        return result
+
+
+class Backend(object):
+    """
+    Long-lived CoreNLP processes behind a Unix socket, so that servers
+    started with --attach can be restarted or added in seconds while the
+    models stay loaded.
+    
+    Any number of connections share the processes, so the models are in
+    memory once per process however many workers attach: each text goes
+    to the next free process, and its output back to the connection it
+    came from.  A connection is greeted with the prompt and from then on
+    talks to the backend as to the interactive shell of a process of its
+    own, one text at a time.
+    """
+    def __init__(self, path, size=1, corenlp_path=None, command=None):
+        """
+        Spawns `size` CoreNLP processes (see StanfordCoreNLP) and listens
+        on the socket at path
+        """
+        self.path = path
+        self.corenlp_path = corenlp_path
+        self.command = command
+        self.requests = queue.Queue()
+        for i in range(size):
+            worker = threading.Thread(target=self._work, args=(StanfordCoreNLP(corenlp_path, command),))
+            worker.daemon = True
+            worker.start()
+        if os.path.exists(path):
+            os.unlink(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen(16)
+    
+    def serve(self):
+        """ Accepts connections forever """
+        while True:
+            conn, addr = self.sock.accept()
+            thread = threading.Thread(target=self._serve, args=(conn,))
+            thread.daemon = True
+            thread.start()
+    
+    def _serve(self, conn):
+        """
+        Connection thread: queues each line the connection sends, once
+        the one before is answered
+        """
+        buffer = b""
+        try:
+            conn.sendall(PROMPT.lstrip().encode('utf-8'))
+            while True:
+                data = conn.recv(READ_SIZE)
+                if not data:
+                    break   # a cut off last line is dropped
+                buffer += data
+                while b"\n" in buffer:
+                    line, buffer = buffer.split(b"\n", 1)
+                    # the shell answers an empty line with a bare prompt,
+                    # which a client can't tell from output, and "q" quits
+                    if not line.strip():
+                        conn.sendall(PROMPT.lstrip().encode('utf-8'))
+                        continue
+                    if line.strip().lower() == b"q":
+                        return
+                    answered = threading.Event()
+                    self.requests.put((line + b"\n", conn, answered))
+                    answered.wait()
+        except OSError:
+            pass
+        finally:
+            conn.close()
+    
+    def _work(self, nlp):
+        """ Worker thread: answers queued lines with its own process """
+        while True:
+            line, conn, answered = self.requests.get()
+            try:
+                self._answer(nlp, line, conn)
+            except (EOFError, ProcessTimeout, OSError) as e:
+                # OSError: e.g. a broken pipe, writing to an exited process
+                logger.error("Error: %s, restarting CoreNLP" % e)
+                metrics.REGISTRY.incr('worker_restarts')
+                # the connection won't get its prompt: let it know
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                nlp = self._restart(nlp)
+            finally:
+                answered.set()
+    
+    def _restart(self, nlp):
+        """
+        Stops the process and returns a new one, retrying with a growing
+        delay until one starts
+        """
+        nlp.close()
+        delay = 1
+        while True:
+            try:
+                return StanfordCoreNLP(self.corenlp_path, self.command)
+            except (EOFError, ProcessTimeout, OSError) as e:
+                logger.error("Error: Could not restart CoreNLP: %s" % e)
+            time.sleep(delay)
+            delay = min(2 * delay, 60)
+    
+    def _answer(self, nlp, line, conn):
+        """
+        Sends the line to the process and its output to the connection
+        as it comes, up to and including the prompt.  The output is read
+        to the end even if the connection is gone, so the process is
+        ready for the next line.  Raises ProcessTimeout if the prompt
+        doesn't come as long after the line's expected time as a client
+        waits for it (see StanfordCoreNLP._communicate).
+        """
+        prompt = PROMPT.encode('utf-8')
+        nlp._send(line)
+        end_time = time.time() + max_expected_time(line) + 40
+        tail = b""
+        connected = True
+        while True:
+            ready, _, _ = select.select([nlp.fd], [], [], max(0, end_time - time.time()))
+            if not ready:
+                raise ProcessTimeout("no prompt after %d seconds" % (max_expected_time(line) + 40))
+            data = os.read(nlp.fd, MAX_READ_SIZE)
+            if not data:
+                raise EOFError("CoreNLP exited")
+            if connected:
+                try:
+                    conn.sendall(data)
+                except OSError:
+                    connected = False
+            # the prompt may be split between two reads
+            if prompt in tail + data:
+                return
+            tail = (tail + data)[-len(prompt):]
+
+
+def iter_documents(path, skip=(), read=True):
+    """
+    Yields (document id, text) for every document under path: each file
+    of a directory is a document, identified by its path relative to the
+    directory; each non-empty line of a plain file is one, identified as
+    "file:line number".  Empty documents and ids in `skip` are left out,
+    and with read=False the texts of whole files aren't read (for
+    counting; files of nothing but whitespace are counted then).
+    """
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                filename = os.path.join(root, name)
+                doc_id = os.path.relpath(filename, path)
+                if doc_id in skip or os.path.getsize(filename) == 0:
+                    continue
+                if not read:
+                    yield doc_id, None
+                    continue
+                with open(filename, encoding='utf-8', errors='replace') as f:
+                    text = f.read()
+                if text.strip():
+                    yield doc_id, text
+    else:
+        with open(path, encoding='utf-8', errors='replace', newline='\n') as f:
+            for i, line in enumerate(f):
+                doc_id = "%s:%d" % (os.path.basename(path), i + 1)
+                if line.strip() and doc_id not in skip:
+                    yield doc_id, line
+
+
+def read_checkpoint(path):
+    """
+    Returns the ids of the documents recorded in a checkpoint file, the
+    size of the output file after the last of them, and the size of the
+    checkpoint file up to its last complete line.
+    """
+    done, size, length = set(), 0, 0
+    if os.path.exists(path):
+        for line in open(path, 'rb'):
+            # a line cut off by an interruption doesn't count
+            if not line.endswith(b"\n"):
+                break
+            doc_id, end = line[:-1].rsplit(b"\t", 1)
+            done.add(json.loads(doc_id))
+            size = int(end)
+            length += len(line)
+    return done, size, length
+
+
+class Throughput(ProgressBarWidget):
+    "Widget for showing the number of documents per second."
+    def update(self, pbar):
+        if pbar.seconds_elapsed < 2e-6:
+            return '  0.00 docs/s'
+        return '%6.2f docs/s' % (pbar.currval / pbar.seconds_elapsed)
+
+
+def annotate(path, parse, output_path, checkpoint_path, threads=1, result_store=None):
+    """
+    Parses the documents under path (see iter_documents) with `threads`
+    concurrent calls of parse(text), which returns the Python
+    data-structure, and appends one line of JSON per document to the
+    output file: the result plus the document's "id".
+
+    After every line written, the document's id and the size of the
+    output are appended to the checkpoint file.  A later run with the same
+    files skips the documents recorded there, after truncating the output
+    to the last recorded size, so an interrupted run resumes where it
+    stopped without duplicates.  Failed documents are logged and not
+    recorded, so they are retried by the next run.  With a `result_store`
+    (a store.Store), each result is also put there under its document id.
+
+    Returns the numbers of documents annotated and failed.
+    """
+    done, size, length = read_checkpoint(checkpoint_path)
+    total = sum(1 for doc in iter_documents(path, done, read=False))
+    if done:
+        logger.info('Resuming: %d documents done, %d to go' % (len(done), total))
+    if not total:
+        return 0, 0
+    output = open(output_path, 'ab')
+    size = min(size, os.path.getsize(output_path))
+    output.truncate(size)
+    checkpoint = open(checkpoint_path, 'ab')
+    checkpoint.truncate(length)
+
+    # a bounded queue keeps memory use flat however large the input
+    todo = queue.Queue(2 * threads)
+    results = queue.Queue()
+
+    def feed():
+        for doc in iter_documents(path, done):
+            todo.put(doc)
+        for i in range(threads):
+            todo.put(None)
+
+    def work():
+        while True:
+            doc = todo.get()
+            if doc is None:
+                results.put(None)
+                return
+            doc_id, text = doc
+            try:
+                result = parse(text)
+                if 'error' in result:
+                    raise Exception(result['error'])
+                results.put((doc_id, result, None))
+            except Exception as e:
+                results.put((doc_id, None, e))
+
+    for target in [feed] + [work] * threads:
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+
+    widgets = ['Annotating: ', Fraction(), ' ', Bar(), ' ', Throughput(), ' ', ETA()]
+    pbar = ProgressBar(widgets=widgets, maxval=max(1, total)).start()
+    annotated, failed, running = 0, 0, threads
+    while running:
+        item = results.get()
+        if item is None:
+            running -= 1
+            continue
+        doc_id, result, error = item
+        if error is not None:
+            logger.error("Error: Could not annotate %s: %s" % (doc_id, error))
+            failed += 1
+        else:
+            if result_store is not None:
+                result_store.put(doc_id, result)
+            # json.dumps escapes non-ASCII characters, so this is ASCII
+            line = (json.dumps(dict(result, id=doc_id)) + "\n").encode('ascii')
+            output.write(line)
+            output.flush()
+            size += len(line)
+            checkpoint.write(("%s\t%d\n" % (json.dumps(doc_id), size)).encode('ascii'))
+            checkpoint.flush()
+            annotated += 1
+        pbar.update(min(annotated + failed, pbar.maxval))
+    pbar.finish()
+    output.close()
+    checkpoint.close()
+    return annotated, failed
+
+
+def main_annotate(argv):
+    """
+    The `annotate` command: parses a corpus into a JSON-lines file
+    """
+    parser = optparse.OptionParser(usage="%prog annotate -i INPUT -o OUTPUT [OPTIONS]")
+    parser.add_option('-i', '--input',
+                      help='Directory with one document per file, or a file with one document per line')
+    parser.add_option('-o', '--output',
+                      help='JSON-lines file the results are appended to')
+    parser.add_option('-c', '--checkpoint', default=None,
+                      help='File recording the finished documents (default: OUTPUT.checkpoint)')
+    parser.add_option('-w', '--workers', default='1',
+                      help='Number of CoreNLP processes, or concurrent requests with --server (default: 1)')
+    parser.add_option('-s', '--server', action='append', default=[],
+                      help='host:port of a corenlp.py server to use instead of local processes (repeatable)')
+    parser.add_option('--store', default=None,
+                      help='Also put the results in a store (see store.py) at this path, by document id')
+    options, args = parser.parse_args(argv)
+    if not options.input or not options.output:
+        parser.error('--input and --output are required')
+    workers = int(options.workers)
+
+    if options.server:
+        from client import StanfordNLPCluster
+        addresses = [(host, int(port)) for host, port in (s.rsplit(':', 1) for s in options.server)]
+        parse = StanfordNLPCluster(addresses, strategy="least-outstanding").parse
+    else:
+        parse = StanfordCoreNLPPool(workers, queue_size=0)._parse
+
+    start_time = time.time()
+    annotated, failed = annotate(options.input, parse, options.output,
+                                 options.checkpoint or options.output + '.checkpoint', workers,
+                                 options.store and store.Store(options.store))
+    logger.info('Annotated %d documents in %.1f seconds (%d failed)' % (
+        annotated, time.time() - start_time, failed))
+    return failed and 1 or 0
+
+
+def main_backend(argv):
+    """
+    The `backend` command: keeps CoreNLP processes running for servers
+    to --attach to
+    """
+    parser = optparse.OptionParser(usage="%prog backend -l PATH [OPTIONS]")
+    parser.add_option('-l', '--listen',
+                      help='Path of the Unix socket to listen on')
+    parser.add_option('-w', '--workers', default='1',
+                      help='Number of CoreNLP processes (default: 1)')
+    options, args = parser.parse_args(argv)
+    if not options.listen:
+        parser.error('--listen is required')
+    backend = Backend(options.listen, int(options.workers))
+    logger.info('Serving %s CoreNLP processes on %s' % (options.workers, options.listen))
+    backend.serve()
 
 
 if __name__ == '__main__':
     """
     The code below starts an JSONRPC server
     """
-    parser = optparse.OptionParser(usage="%prog [OPTIONS]")
+    if sys.argv[1:2] == ['annotate']:
+        sys.exit(main_annotate(sys.argv[2:]))
+    if sys.argv[1:2] == ['backend']:
+        sys.exit(main_backend(sys.argv[2:]))
+
+    parser = optparse.OptionParser(usage="%prog [OPTIONS]\n       %prog annotate --help\n       %prog backend --help")
     parser.add_option('-p', '--port', default='8080',
                       help='Port to serve on (default: 8080)')
     parser.add_option('-H', '--host', default='127.0.0.1',
                       help='Host to serve on (default: 127.0.0.1. Use 0.0.0.0 to make public)')
+    parser.add_option('-u', '--unix', default=None,
+                      help='Serve on a Unix socket at this path instead of TCP, for clients on the same host')
+    parser.add_option('-S', '--shm-threshold', default='0',
+                      help='With --unix, hand responses of this many bytes or more to clients in shared memory (default: 0 = never)')
+    parser.add_option('-w', '--workers', default='1',
+                      help='Number of CoreNLP processes parsing concurrently (default: 1)')
+    parser.add_option('-a', '--attach', default=None,
+                      help='Use the CoreNLP processes of a `backend` listening at this path instead of spawning them')
+    parser.add_option('-P', '--processes', default='0',
+                      help='Number of Python processes turning CoreNLP output into JSON (default: 0 = done by the workers)')
+    parser.add_option('-R', '--recycle-after', default='0',
+                      help='Replace each CoreNLP process after it parsed this many texts (default: 0 = never)')
+    parser.add_option('-M', '--max-rss', default='0',
+                      help='Replace a CoreNLP process once its resident memory exceeds this many MB (default: 0 = never)')
+    parser.add_option('-D', '--max-drift', default='0',
+                      help='Replace a CoreNLP process once its parses got this many times slower than its first ones (default: 0 = never)')
+    parser.add_option('-q', '--queue-size', default='1000',
+                      help='Max. number of texts waiting for a free process, per priority lane (default: 1000, 0 = no limit)')
+    parser.add_option('-E', '--result-ttl', default='3600',
+                      help='Seconds to keep submitted results that are not fetched (default: 3600, 0 = until fetched)')
+    parser.add_option('-T', '--threads', default=None,
+                      help='Max. number of requests handled at once (default: enough for all the texts the workers and queues admit, plus 64; 0 = no limit)')
+    parser.add_option('-d', '--deadline', default='0',
+                      help='Seconds a parse request may take before failing, unless it sets its own timeout (default: 0 = no limit)')
+    parser.add_option('-m', '--metrics-port', default=None,
+                      help='Port to serve Prometheus metrics on at /metrics (default: none)')
+    parser.add_option('-t', '--trees', action='store_true', default=False,
+                      help='Add parse trees as arrays (see trees.py) to every sentence')
+    parser.add_option('-r', '--coref-index', action='store_true', default=False,
+                      help='Return coreference as a mention index (see coreference.py) instead of pairs')
+    parser.add_option('-C', '--cache', default=None,
+                      help='Keep the results in a store (see store.py) at this path and answer repeated texts from it (default: none)')
     options, args = parser.parse_args()
-    server = jsonrpc.Server(jsonrpc.JsonRpc20(),
-                            jsonrpc.TransportTcpIp(addr=(options.host, int(options.port))))
+    if options.threads is not None:
+        threads = int(options.threads)
+    elif int(options.queue_size):
+        # every admitted text holds a thread until it is parsed, and the
+        # queues only reject texts if further requests can still be read
+        threads = int(options.workers) + 2 * int(options.queue_size) + 64
+    else:
+        threads = 0
+    if options.unix:
+        if os.path.exists(options.unix):
+            os.unlink(options.unix)
+        transport = jsonrpc.TransportUnixSocket(addr=options.unix, statfunc=metrics.REGISTRY.observe,
+                                                threads=threads, shm_threshold=int(options.shm_threshold))
+    else:
+        transport = jsonrpc.TransportTcpIp(addr=(options.host, int(options.port)),
+                                           statfunc=metrics.REGISTRY.observe, threads=threads)
+    server = jsonrpc.Server(jsonrpc.JsonRpc20(), transport)
     
-    nlp = StanfordCoreNLP()
+    nlp = StanfordCoreNLPPool(int(options.workers), queue_size=int(options.queue_size),
+                              timeout=float(options.deadline) or None,
+                              cache=options.cache and store.Store(options.cache),
+                              tree=options.trees, coref_index=options.coref_index,
+                              processes=int(options.processes), attach=options.attach,
+                              recycle_after=int(options.recycle_after),
+                              max_rss=int(options.max_rss) << 20, max_drift=float(options.max_drift),
+                              result_ttl=float(options.result_ttl))
     server.register_function(nlp.parse)
+    server.register_function(nlp.submit)
+    server.register_function(nlp.fetch)
+    server.register_function(nlp.wait_any)
+    server.register_function(nlp.stats)
+    server.register_function(nlp.profile)
+    server.register_function(nlp.profile_dump)
+    
+    if options.metrics_port:
+        metrics.serve_http((options.host, int(options.metrics_port)))
+        logger.info('Serving metrics on http://%s:%s/metrics' % (options.host, options.metrics_port))
+    
+    def stop(signum, frame):
+        logger.info('Finishing the requests in progress, then exiting (signal %d)' % signum)
+        # a second signal exits right away
+        signal.signal(signum, signal.SIG_DFL)
+        server.stop()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    # reload default.properties, replacing the processes one by one
+    signal.signal(signal.SIGHUP, lambda signum, frame: nlp.reload())
     
-    logger.info('Serving on http://%s:%s' % (options.host, options.port))
+    if options.unix:
+        logger.info('Serving on %s' % options.unix)
+    else:
+        logger.info('Serving on http://%s:%s' % (options.host, options.port))
     server.serve()
+    if options.unix:
+        os.unlink(options.unix)
+    nlp.close()
+    logger.info('Stopped')
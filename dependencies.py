@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+#
+# dependencies  - indexed dependency graphs of parsed sentences
+# Copyright (c) 2014 Dustin Smith
+#   https://github.com/dasmith/stanford-corenlp-python
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+Dependencies by token index.  Besides the (rel, governor, dependent)
+word triples in 'dependencies', parse_parser_results() gives every
+sentence:
+
+  indexed_dependencies  [rel, governor, dependent] triples of 0-based
+                        token indices, ROOT being -1
+  heads                 the governor of each token: -1 for the root,
+                        None for tokens without one (e.g. punctuation)
+  rels                  the relation of each token to its governor
+  children              the dependents of each token
+
+CoreNLP's collapsed dependencies are a graph, so a token may have more
+than one governor: `heads` and `rels` hold the first one listed, while
+`children` and `indexed_dependencies` have all edges.
+
+The functions below work on such a sentence, also as decoded from JSON:
+
+    i = dependencies.roots(sentence)[0]
+    [sentence['words'][j][0] for j in dependencies.subtree(sentence, i)]
+"""
+
+import re
+
+
+ROOT = -1
+DEPENDENCY_PATTERN = re.compile(r"^([^(]+)\((.+)-(\d+)'*, (.+)-(\d+)'*\)$")
+
+
+def parse_dependency(line):
+    """
+    Splits a line like "nsubj(located-4, University-2)" into (relation,
+    governor word, governor index, dependent word, dependent index), with
+    0-based indices; None if it isn't one.
+    """
+    m = DEPENDENCY_PATTERN.match(line)
+    if m is None:
+        return None
+    rel, gov, gov_i, dep, dep_i = m.groups()
+    return rel, gov, int(gov_i) - 1, dep, int(dep_i) - 1
+
+
+def index(edges, n):
+    """
+    The heads, rels and children (see above) of a sentence of n tokens
+    with the given [rel, governor, dependent] edges
+    """
+    heads = [None] * n
+    rels = [None] * n
+    children = [[] for i in range(n)]
+    for rel, gov, dep in edges:
+        if not 0 <= dep < n or gov >= n:
+            continue
+        if heads[dep] is None:
+            heads[dep] = gov
+            rels[dep] = rel
+        if gov != ROOT:
+            children[gov].append(dep)
+    return {'heads': heads, 'rels': rels, 'children': children}
+
+
+def head(sentence, i):
+    """ The governor of token i (ROOT or None if it has none) """
+    return sentence['heads'][i]
+
+
+def children(sentence, i, rel=None):
+    """ The dependents of token i, only those related by rel if given """
+    if rel is None:
+        return sentence['children'][i]
+    return [j for r, gov, j in sentence['indexed_dependencies'] if gov == i and r == rel]
+
+
+def roots(sentence):
+    """ The tokens governed by ROOT """
+    return [i for i, h in enumerate(sentence['heads']) if h == ROOT]
+
+
+def subtree(sentence, i):
+    """ Token i and all tokens it governs, directly or not, in order """
+    seen = set([i])
+    stack = [i]
+    while stack:
+        for j in sentence['children'][stack.pop()]:
+            if j not in seen:
+                seen.add(j)
+                stack.append(j)
+    return sorted(seen)
+
+
+def ancestors(sentence, i):
+    """ Token i, its governor, the governor's governor, ... up to the root """
+    chain = [i]
+    heads = sentence['heads']
+    while heads[chain[-1]] not in (None, ROOT) and heads[chain[-1]] not in chain:
+        chain.append(heads[chain[-1]])
+    return chain
+
+
+def path(sentence, i, j):
+    """
+    The tokens on the path from token i up to the closest governor it
+    shares with token j and down to j, or None if they aren't connected
+    """
+    up = ancestors(sentence, i)
+    down = ancestors(sentence, j)
+    common = set(up).intersection(down)
+    if not common:
+        return None
+    top = min(up.index(k) for k in common)
+    return up[:top + 1] + list(reversed(down[:down.index(up[top])]))
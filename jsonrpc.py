@@ -21,9 +21,9 @@ Currently, JSON-RPC 2.0(pre) and JSON-RPC 1.0 are implemented
 
         >>> proxy = ServerProxy( JsonRpc20(), TransportTcpIp(addr=("127.0.0.1",31415)) )
         >>> proxy.echo( "hello world" )
-        u'hello world'
+        'hello world'
         >>> proxy.echo( "bye." )
-        u'bye.'
+        'bye.'
 
     simple Server with JsonRPC2.0 and TCP/IP with logging to STDOUT::
 
@@ -34,26 +34,35 @@ Currently, JSON-RPC 2.0(pre) and JSON-RPC 1.0 are implemented
         >>> server.serve( 2 )   # serve 2 requests          # doctest: +ELLIPSIS
         listen ('127.0.0.1', 31415)
         ('127.0.0.1', ...) connected
-        ('127.0.0.1', ...) <-- {"jsonrpc": "2.0", "method": "echo", "params": ["hello world"], "id": 0}
-        ('127.0.0.1', ...) --> {"jsonrpc": "2.0", "result": "hello world", "id": 0}
+        ('127.0.0.1', ...) <-- {"jsonrpc": "2.0", "method": "echo", "params": ["hello world"], "id": 1}
+        ('127.0.0.1', ...) --> {"jsonrpc": "2.0", "result": "hello world", "id": 1}
         ('127.0.0.1', ...) close
         ('127.0.0.1', ...) connected
-        ('127.0.0.1', ...) <-- {"jsonrpc": "2.0", "method": "echo", "params": ["bye."], "id": 0}
-        ('127.0.0.1', ...) --> {"jsonrpc": "2.0", "result": "bye.", "id": 0}
+        ('127.0.0.1', ...) <-- {"jsonrpc": "2.0", "method": "echo", "params": ["bye."], "id": 2}
+        ('127.0.0.1', ...) --> {"jsonrpc": "2.0", "result": "bye.", "id": 2}
         ('127.0.0.1', ...) close
         close ('127.0.0.1', 31415)
 
+    pipelined calls over one connection (responses are matched by id)::
+
+        >>> multicall = MultiCall( proxy )
+        >>> multicall.echo( "hello" )
+        >>> multicall.echo( "world" )
+        >>> list( multicall() )
+        ['hello', 'world']
+
     Client with JsonRPC2.0 and an abstract Unix Domain Socket::
     
         >>> proxy = ServerProxy( JsonRpc20(), TransportUnixSocket(addr="\\x00.rpcsocket") )
         >>> proxy.hi( message="hello" )         #named parameters
-        u'hi there'
+        'hi there'
         >>> proxy.test()                        #fault
         Traceback (most recent call last):
           ...
-        jsonrpc.RPCMethodNotFound: <RPCFault -32601: u'Method not found.' (None)>
+        jsonrpc.RPCMethodNotFound: <RPCFault -32601: 'Method not found.' (None)>
         >>> proxy.debug.echo( "hello world" )   #hierarchical procedures
-        u'hello world'
+        'hello world'
+        >>> proxy._notify.hi( message="bye" )   #notification, no response
 
     Server with JsonRPC2.0 and abstract Unix Domain Socket with a logfile::
         
@@ -69,16 +78,16 @@ Currently, JSON-RPC 2.0(pre) and JSON-RPC 1.0 are implemented
         "mylog.txt" then contains:
         listen '\\x00.rpcsocket'
         '' connected
-        '' --> '{"jsonrpc": "2.0", "method": "hi", "params": {"message": "hello"}, "id": 0}'
-        '' <-- '{"jsonrpc": "2.0", "result": "hi there", "id": 0}'
+        '' --> '{"jsonrpc": "2.0", "method": "hi", "params": {"message": "hello"}, "id": 1}'
+        '' <-- '{"jsonrpc": "2.0", "result": "hi there", "id": 1}'
         '' close
         '' connected
-        '' --> '{"jsonrpc": "2.0", "method": "test", "id": 0}'
-        '' <-- '{"jsonrpc": "2.0", "error": {"code":-32601, "message": "Method not found."}, "id": 0}'
+        '' --> '{"jsonrpc": "2.0", "method": "test", "id": 2}'
+        '' <-- '{"jsonrpc": "2.0", "error": {"code":-32601, "message": "Method not found."}, "id": 2}'
         '' close
         '' connected
-        '' --> '{"jsonrpc": "2.0", "method": "debug.echo", "params": ["hello world"], "id": 0}'
-        '' <-- '{"jsonrpc": "2.0", "result": "hello world", "id": 0}'
+        '' --> '{"jsonrpc": "2.0", "method": "debug.echo", "params": ["hello world"], "id": 3}'
+        '' <-- '{"jsonrpc": "2.0", "result": "hello world", "id": 3}'
         '' close
         close '\\x00.rpcsocket'
 
@@ -99,7 +108,6 @@ Currently, JSON-RPC 2.0(pre) and JSON-RPC 1.0 are implemented
 
 TODO:
         - server: multithreading rpc-server
-        - client: multicall (send several requests)
         - transport: SSL sockets, maybe HTTP, HTTPS
         - types: support for date/time (ISO 8601)
         - errors: maybe customizable error-codes/exceptions
@@ -135,6 +143,8 @@ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE."""
 #import
 
 import sys
+import itertools
+import threading
 
 try:
     import json
@@ -160,6 +170,8 @@ PROCEDURE_EXCEPTION    = -32000
 AUTHENTIFICATION_ERROR = -32001
 PERMISSION_DENIED      = -32002
 INVALID_PARAM_VALUES   = -32003
+SERVER_BUSY            = -32004
+DEADLINE_EXCEEDED      = -32005
 
 #human-readable messages
 ERROR_MESSAGE = {
@@ -172,7 +184,9 @@ ERROR_MESSAGE = {
     PROCEDURE_EXCEPTION   : "Procedure exception.",
     AUTHENTIFICATION_ERROR : "Authentification error.",
     PERMISSION_DENIED   : "Permission denied.",
-    INVALID_PARAM_VALUES: "Invalid parameter values."
+    INVALID_PARAM_VALUES: "Invalid parameter values.",
+    SERVER_BUSY         : "Server busy.",
+    DEADLINE_EXCEEDED   : "Deadline exceeded."
     }
  
 #----------------------
@@ -200,6 +214,8 @@ class RPCFault(RPCError):
                         (must be json-serializable)
     :TODO: improve __str__
     """
+    id = None   #id of the request the fault belongs to (set for received faults)
+
     def __init__(self, error_code, error_message, error_data=None):
         RPCError.__init__(self)
         self.error_code   = error_code
@@ -252,6 +268,42 @@ class RPCInvalidParamValues(RPCFault):
     """INVALID_PARAM_VALUES"""
     def __init__(self, error_data=None):
         RPCFault.__init__(self, INVALID_PARAM_VALUES, ERROR_MESSAGE[INVALID_PARAM_VALUES], error_data)
+class RPCServerBusy(RPCFault):
+    """SERVER_BUSY"""
+    def __init__(self, error_data=None):
+        RPCFault.__init__(self, SERVER_BUSY, ERROR_MESSAGE[SERVER_BUSY], error_data)
+class RPCDeadlineExceeded(RPCFault):
+    """DEADLINE_EXCEEDED"""
+    def __init__(self, error_data=None):
+        RPCFault.__init__(self, DEADLINE_EXCEEDED, ERROR_MESSAGE[DEADLINE_EXCEEDED], error_data)
+
+#error-code -> exception (for received error-packages)
+ERROR_CLASS = {
+    PARSE_ERROR           : RPCParseError,
+    INVALID_REQUEST       : RPCInvalidRPC,
+    METHOD_NOT_FOUND      : RPCMethodNotFound,
+    INVALID_METHOD_PARAMS : RPCInvalidMethodParams,
+    INTERNAL_ERROR        : RPCInternalError,
+
+    PROCEDURE_EXCEPTION   : RPCProcedureException,
+    AUTHENTIFICATION_ERROR : RPCAuthentificationError,
+    PERMISSION_DENIED     : RPCPermissionDenied,
+    INVALID_PARAM_VALUES  : RPCInvalidParamValues,
+    SERVER_BUSY           : RPCServerBusy,
+    DEADLINE_EXCEEDED     : RPCDeadlineExceeded,
+    }
+
+def fault_from_error( code, message, data=None, id=None ):
+    """create the RPCFault(-derivate) for a received error-object
+
+    :Returns: an exception-instance, with .id set to the request-id
+    """
+    if code in ERROR_CLASS:
+        err = ERROR_CLASS[code](data)
+    else:
+        err = RPCFault(code, message, data)
+    err.id = id
+    return err
 
 
 #=========================================
@@ -260,13 +312,14 @@ class RPCInvalidParamValues(RPCFault):
 #----------------------
 #
 def dictkeyclean(d):
-    """Convert all keys of the dict 'd' to (ascii-)strings.
+    """Check that all keys of the dict 'd' are ascii-strings.
 
     :Raises: UnicodeEncodeError
     """
     new_d = {}
-    for (k, v) in d.iteritems():
-        new_d[str(k)] = v
+    for (k, v) in d.items():
+        k.encode('ascii')
+        new_d[k] = v
     return new_d
 
 #----------------------
@@ -299,7 +352,7 @@ class JsonRpc10:
         """serialize JSON-RPC-Request
 
         :Parameters:
-            - method: the method-name (str/unicode)
+            - method: the method-name (str)
             - params: the parameters (list/tuple)
             - id:     if id=None, this results in a Notification
         :Returns:   | {"method": "...", "params": ..., "id": ...}
@@ -307,8 +360,8 @@ class JsonRpc10:
         :Raises:    TypeError if method/params is of wrong type or 
                     not JSON-serializable
         """
-        if not isinstance(method, (str, unicode)):
-            raise TypeError('"method" must be a string (or unicode string).')
+        if not isinstance(method, str):
+            raise TypeError('"method" must be a string.')
         if not isinstance(params, (tuple, list)):
             raise TypeError("params must be a tuple/list.")
 
@@ -323,8 +376,8 @@ class JsonRpc10:
                     | "method", "params" and "id" are always in this order.
         :Raises:    see dumps_request
         """
-        if not isinstance(method, (str, unicode)):
-            raise TypeError('"method" must be a string (or unicode string).')
+        if not isinstance(method, str):
+            raise TypeError('"method" must be a string.')
         if not isinstance(params, (tuple, list)):
             raise TypeError("params must be a tuple/list.")
 
@@ -373,11 +426,11 @@ class JsonRpc10:
         """
         try:
             data = self.loads(string)
-        except ValueError, err:
+        except ValueError as err:
             raise RPCParseError("No valid JSON. (%s)" % str(err))
         if not isinstance(data, dict):  raise RPCInvalidRPC("No valid RPC-package.")
         if "method" not in data:        raise RPCInvalidRPC("""Invalid Request, "method" is missing.""")
-        if not isinstance(data["method"], (str, unicode)):
+        if not isinstance(data["method"], str):
             raise RPCInvalidRPC("""Invalid Request, "method" must be a string.""")
         if "id"     not in data:        data["id"]     = None   #be liberal
         if "params" not in data:        data["params"] = ()     #be liberal
@@ -401,7 +454,7 @@ class JsonRpc10:
         """
         try:
             data = self.loads(string)
-        except ValueError, err:
+        except ValueError as err:
             raise RPCParseError("No valid JSON. (%s)" % str(err))
         if not isinstance(data, dict):  raise RPCInvalidRPC("No valid RPC-package.")
         if "id" not in data:            raise RPCInvalidRPC("""Invalid Response, "id" missing.""")
@@ -421,29 +474,10 @@ class JsonRpc10:
                 else:
                     error_data = data["error"]["data"]
 
-                if   data["error"]["code"] == PARSE_ERROR:
-                    raise RPCParseError(error_data)
-                elif data["error"]["code"] == INVALID_REQUEST:
-                    raise RPCInvalidRPC(error_data)
-                elif data["error"]["code"] == METHOD_NOT_FOUND:
-                    raise RPCMethodNotFound(error_data)
-                elif data["error"]["code"] == INVALID_METHOD_PARAMS:
-                    raise RPCInvalidMethodParams(error_data)
-                elif data["error"]["code"] == INTERNAL_ERROR:
-                    raise RPCInternalError(error_data)
-                elif data["error"]["code"] == PROCEDURE_EXCEPTION:
-                    raise RPCProcedureException(error_data)
-                elif data["error"]["code"] == AUTHENTIFICATION_ERROR:
-                    raise RPCAuthentificationError(error_data)
-                elif data["error"]["code"] == PERMISSION_DENIED:
-                    raise RPCPermissionDenied(error_data)
-                elif data["error"]["code"] == INVALID_PARAM_VALUES:
-                    raise RPCInvalidParamValues(error_data)
-                else:
-                    raise RPCFault(data["error"]["code"], data["error"]["message"], error_data)
+                raise fault_from_error(data["error"]["code"], data["error"]["message"], error_data, data["id"])
             #other error-format
             else:
-                raise RPCFault(-1, "Error", data["error"])
+                raise fault_from_error(-1, "Error", data["error"], data["id"])
         #result
         else:
             return data["result"], data["id"]
@@ -474,7 +508,7 @@ class JsonRpc20:
         """serialize JSON-RPC-Request
 
         :Parameters:
-            - method: the method-name (str/unicode)
+            - method: the method-name (str)
             - params: the parameters (list/tuple/dict)
             - id:     the id (should not be None)
         :Returns:   | {"jsonrpc": "2.0", "method": "...", "params": ..., "id": ...}
@@ -483,8 +517,8 @@ class JsonRpc20:
         :Raises:    TypeError if method/params is of wrong type or 
                     not JSON-serializable
         """
-        if not isinstance(method, (str, unicode)):
-            raise TypeError('"method" must be a string (or unicode string).')
+        if not isinstance(method, str):
+            raise TypeError('"method" must be a string.')
         if not isinstance(params, (tuple, list, dict)):
             raise TypeError("params must be a tuple/list/dict or None.")
 
@@ -503,8 +537,8 @@ class JsonRpc20:
                     | "jsonrpc", "method" and "params" are always in this order.
         :Raises:    see dumps_request
         """
-        if not isinstance(method, (str, unicode)):
-            raise TypeError('"method" must be a string (or unicode string).')
+        if not isinstance(method, str):
+            raise TypeError('"method" must be a string.')
         if not isinstance(params, (tuple, list, dict)):
             raise TypeError("params must be a tuple/list/dict or None.")
 
@@ -554,18 +588,18 @@ class JsonRpc20:
         """
         try:
             data = self.loads(string)
-        except ValueError, err:
+        except ValueError as err:
             raise RPCParseError("No valid JSON. (%s)" % str(err))
         if not isinstance(data, dict):  raise RPCInvalidRPC("No valid RPC-package.")
         if "jsonrpc" not in data:       raise RPCInvalidRPC("""Invalid Response, "jsonrpc" missing.""")
-        if not isinstance(data["jsonrpc"], (str, unicode)):
+        if not isinstance(data["jsonrpc"], str):
             raise RPCInvalidRPC("""Invalid Response, "jsonrpc" must be a string.""")
         if data["jsonrpc"] != "2.0":    raise RPCInvalidRPC("""Invalid jsonrpc version.""")
         if "method" not in data:        raise RPCInvalidRPC("""Invalid Request, "method" is missing.""")
-        if not isinstance(data["method"], (str, unicode)):
+        if not isinstance(data["method"], str):
             raise RPCInvalidRPC("""Invalid Request, "method" must be a string.""")
         if "params" not in data:        data["params"] = ()
-        #convert params-keys from unicode to str
+        #params-keys must be ascii (python-identifiers)
         elif isinstance(data["params"], dict):
             try:
                 data["params"] = dictkeyclean(data["params"])
@@ -590,11 +624,11 @@ class JsonRpc20:
         """
         try:
             data = self.loads(string)
-        except ValueError, err:
+        except ValueError as err:
             raise RPCParseError("No valid JSON. (%s)" % str(err))
         if not isinstance(data, dict):  raise RPCInvalidRPC("No valid RPC-package.")
         if "jsonrpc" not in data:       raise RPCInvalidRPC("""Invalid Response, "jsonrpc" missing.""")
-        if not isinstance(data["jsonrpc"], (str, unicode)):
+        if not isinstance(data["jsonrpc"], str):
             raise RPCInvalidRPC("""Invalid Response, "jsonrpc" must be a string.""")
         if data["jsonrpc"] != "2.0":    raise RPCInvalidRPC("""Invalid jsonrpc version.""")
         if "id" not in data:            raise RPCInvalidRPC("""Invalid Response, "id" missing.""")
@@ -614,26 +648,7 @@ class JsonRpc20:
                 raise RPCInvalidRPC("Invalid Response, invalid error-object.")
 
             error_data = data["error"]["data"]
-            if   data["error"]["code"] == PARSE_ERROR:
-                raise RPCParseError(error_data)
-            elif data["error"]["code"] == INVALID_REQUEST:
-                raise RPCInvalidRPC(error_data)
-            elif data["error"]["code"] == METHOD_NOT_FOUND:
-                raise RPCMethodNotFound(error_data)
-            elif data["error"]["code"] == INVALID_METHOD_PARAMS:
-                raise RPCInvalidMethodParams(error_data)
-            elif data["error"]["code"] == INTERNAL_ERROR:
-                raise RPCInternalError(error_data)
-            elif data["error"]["code"] == PROCEDURE_EXCEPTION:
-                raise RPCProcedureException(error_data)
-            elif data["error"]["code"] == AUTHENTIFICATION_ERROR:
-                raise RPCAuthentificationError(error_data)
-            elif data["error"]["code"] == PERMISSION_DENIED:
-                raise RPCPermissionDenied(error_data)
-            elif data["error"]["code"] == INVALID_PARAM_VALUES:
-                raise RPCInvalidParamValues(error_data)
-            else:
-                raise RPCFault(data["error"]["code"], data["error"]["message"], error_data)
+            raise fault_from_error(data["error"]["code"], data["error"]["message"], error_data, data["id"])
         #result
         else:
             return data["result"], data["id"]
@@ -651,9 +666,12 @@ import time
 def log_dummy( message ):
     """dummy-logger: do nothing"""
     pass
+def stat_dummy( name, seconds ):
+    """dummy-statistics: ignore timings"""
+    pass
 def log_stdout( message ):
-    """print message to STDOUT"""
-    print message
+    """print( message ) to STDOUT"""
+    print( message )
 
 def log_file( filename ):
     """return a logfunc which logs to a file (in utf-8)"""
@@ -700,11 +718,9 @@ class Transport:
         - call result = handler(data)
         - send back result if not None
 
-        The serving can be stopped by SIGINT.
+        The serving can be stopped by SIGINT, or (for sockets) by stop().
 
         :TODO:
-            - how to stop?
-              maybe use a .run-file, and stop server if file removed?
             - maybe make n_current accessible? (e.g. for logging)
         """
         n_current = 0
@@ -725,17 +741,97 @@ class TransportSTDINOUT(Transport):
     """
     def send(self, string):
         """write data to STDOUT with '***SEND:' prefix """
-        print "***SEND:"
-        print string
+        print( "***SEND:" )
+        print( string )
     def recv(self):
         """read data from STDIN"""
-        print "***RECV (please enter, ^D ends.):"
+        print( "***RECV (please enter, ^D ends.):" )
         return sys.stdin.read()
 
 
-import socket, select
+import os
+import socket
+
+# shared memory for large messages between co-located client and server
+# (see TransportUnixSocket): the message is written to an anonymous memory
+# file (Linux memfd), whose descriptor is passed over the socket along
+# with the line "shm:<size>"; the memory is freed once both have closed it
+SHM_AVAILABLE = hasattr(os, "memfd_create") and hasattr(socket, "send_fds")
+SHM_HELLO  = "shm"   #sent by a client which reads messages from shared memory
+
+def shm_write( data ):
+    """write bytes to a new anonymous memory file; returns its descriptor"""
+    fd = os.memfd_create( "jsonrpc-shm", os.MFD_CLOEXEC )
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write( fd, view ):]
+    except:
+        os.close( fd )
+        raise
+    return fd
+
+def shm_read( fd, size ):
+    """read size bytes from the start of a memory file, and close it"""
+    try:
+        chunks, offset = [], 0
+        while offset < size:
+            chunk = os.pread( fd, size - offset, offset )
+            if not chunk:
+                raise ValueError("shared memory of %d instead of %d bytes" % (offset, size))
+            chunks.append( chunk )
+            offset += len(chunk)
+        return b"".join(chunks)
+    finally:
+        os.close( fd )
+
+def sendmessage( sock, data, fd=None ):
+    """send data, and the descriptor fd (closing it) with its first byte"""
+    if fd is None:
+        sock.sendall( data )
+        return
+    try:
+        sent = socket.send_fds( sock, [data], [fd] )
+    finally:
+        os.close( fd )   #the receiver got its own
+    sock.sendall( data[sent:] )
+
+def recvline( sock, buffer=b"", limit=4096, fds=None ):
+    """receive one newline-terminated message from a socket.
+
+    :Parameters:
+        - sock:   the socket
+        - buffer: data (bytes) already received, but not yet consumed
+        - limit:  max. size of one recv()
+        - fds:    a list to append descriptors passed along to (Unix
+                  sockets only), None=don't receive any
+    :Returns: (message, rest) -- message (str, decoded from utf-8) is None
+              if the connection was closed before any data arrived; data
+              which is not terminated by a newline is returned as message
+              when the connection closes. rest are bytes.
+    """
+    chunks = [buffer]
+    while b"\n" not in chunks[-1]:
+        if fds is None:
+            d = sock.recv( limit )
+        else:
+            d, received, flags, addr = socket.recv_fds( sock, limit, 4 )
+            fds.extend( received )
+        if len(d) == 0:
+            break
+        chunks.append( d )
+    data = b"".join(chunks)
+    if not data:
+        return None, b""
+    message, _, rest = data.partition(b"\n")
+    return message.decode("utf-8"), rest
+
 class TransportSocket(Transport):
     """Transport via socket.
+
+    Every message is terminated by a newline ("\\n"), so a connection can
+    carry several requests and responses; the serializer must therefore
+    not produce newlines (json.dumps without indent doesn't).
    
     :SeeAlso:   python-module socket
     :TODO:
@@ -743,12 +839,19 @@ class TransportSocket(Transport):
         - improve this (e.g. make sure that connections are closed, socket-files are deleted etc.)
         - exception-handling? (socket.error)
     """
-    def __init__( self, addr, limit=4096, sock_type=socket.AF_INET, sock_prot=socket.SOCK_STREAM, timeout=5.0, logfunc=log_dummy ):
+    def __init__( self, addr, limit=4096, sock_type=socket.AF_INET, sock_prot=socket.SOCK_STREAM, timeout=5.0, logfunc=log_dummy, persistent=False, threads=16, statfunc=stat_dummy ):
         """
         :Parameters:
             - addr: socket-address
             - timeout: timeout in seconds
             - logfunc: function for logging, logfunc(message)
+            - statfunc: function for timings, statfunc(name, seconds);
+                        server: "rpc_request" (handler) and "socket_send"
+            - persistent: client: keep the connection open between requests
+            - threads: server: max. number of requests handled concurrently,
+                       0=no limit; further requests are not read until
+                       one is finished, so admission control in the
+                       handler needs enough threads for all it admits
         :Raises: socket.timeout after timeout
         """
         self.limit  = limit
@@ -756,8 +859,18 @@ class TransportSocket(Transport):
         self.s_type = sock_type
         self.s_prot = sock_prot
         self.s      = None
+        self.buffer = b""
         self.timeout = timeout
         self.log    = logfunc
+        self.stat   = statfunc
+        self.persistent = persistent
+        self.threads = threads
+        self.shm    = False   #read "shm:" messages (see TransportUnixSocket)
+        self.shm_threshold = 0
+        self.fds    = []      #client: passed descriptors not yet read
+        self.__finished = threading.Event()
+        self.__conns    = set()   # server: open connections
+        self.__conns_lock = threading.Lock()
     def connect( self ):
         self.close()
         self.log( "connect to %s" % repr(self.addr) )
@@ -769,90 +882,240 @@ class TransportSocket(Transport):
             self.log( "close %s" % repr(self.addr) )
             self.s.close()
             self.s = None
+        self.buffer = b""
+        while self.fds:
+            os.close( self.fds.pop() )
     def __repr__(self):
         return "<TransportSocket, %s>" % repr(self.addr)
     
+    def _dumps( self, string, shm_threshold=0 ):
+        """encode a message: (bytes, descriptor of its shared memory or None)
+
+        The message goes via shared memory if it has shm_threshold bytes
+        or more.
+        """
+        data = string.encode("utf-8")
+        if shm_threshold and len(data) >= shm_threshold:
+            return ("shm:%d\n" % len(data)).encode("utf-8"), shm_write(data)
+        return data + b"\n", None
+    def _loads( self, message, fds ):
+        """the message itself, if it was sent via shared memory"""
+        if self.shm and message.startswith("shm:"):
+            if not fds:
+                raise ValueError("no shared memory passed along")
+            return shm_read( fds.pop(0), int(message[4:]) ).decode("utf-8")
+        return message
+
     def send( self, string ):
+        hello = b""
         if self.s is None:
             self.connect()
-        self.log( "--> "+repr(string) )
-        self.s.sendall( string )
+            if self.shm_threshold:
+                hello = (SHM_HELLO + "\n").encode("utf-8")
+        data, fd = self._dumps( string, self.shm_threshold )
+        if self.log is not log_dummy:   #repr() copies the whole message
+            self.log( "--> "+repr(string) )
+        sendmessage( self.s, hello + data, fd )
     def recv( self ):
         if self.s is None:
             self.connect()
-        data = self.s.recv( self.limit )
-        while( select.select((self.s,), (), (), 0.1)[0] ):  #TODO: this select is probably not necessary, because server closes this socket
-            d = self.s.recv( self.limit )
-            if len(d) == 0:
-                break
-            data += d
-        self.log( "<-- "+repr(data) )
+        data, self.buffer = recvline( self.s, self.buffer, self.limit, self.fds if self.shm else None )
+        if data is None:
+            raise socket.error("connection closed by %s" % repr(self.addr))
+        data = self._loads( data, self.fds )
+        if self.log is not log_dummy:   #repr() copies the whole message
+            self.log( "<-- "+repr(data) )
         return data
 
     def sendrecv( self, string ):
-        """send data + receive data + close"""
+        """send data + receive data (+ close, if not persistent)"""
         try:
             self.send( string )
             return self.recv()
-        finally:
+        except:
             self.close()
+            raise
+        finally:
+            if not self.persistent:
+                self.close()
     def serve(self, handler, n=None):
         """open socket, wait for incoming connections and handle them.
+
+        Every connection is read by its own thread and may carry several
+        requests. Each request is handled in a separate thread (at most
+        self.threads at a time), and its response is sent back as soon as
+        it is ready -- not necessarily in request-order, so pipelining
+        clients have to match responses by id.
+
+        Returns after n requests or stop(), once all requests received
+        so far are answered.
         
         :Parameters:
             - n: serve n requests, None=forever
         """
         self.close()
         self.s = socket.socket( self.s_type, self.s_prot )
+        self.__slots    = threading.BoundedSemaphore( self.threads or sys.maxsize )
+        self.__n        = n
+        self.__n_lock   = threading.Lock()
+        connections = []
         try:
             self.log( "listen %s" % repr(self.addr) )
+            if self.s_type != getattr(socket, "AF_UNIX", None):
+                # a restarted server can listen again right away
+                self.s.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
             self.s.bind( self.addr )
-            self.s.listen(1)
-            n_current = 0
+            self.s.listen( socket.SOMAXCONN )   #admission control is up to the handler
+            self.s.settimeout( 0.5 )   #to notice self.__finished
+            while not self.__finished.is_set():
+                try:
+                    conn, addr = self.s.accept()
+                except socket.timeout:
+                    continue
+                conn.settimeout( None )
+                with self.__conns_lock:
+                    self.__conns.add( conn )
+                self.log( "%s connected" % repr(addr) )
+                t = threading.Thread( target=self.__serve_connection, args=(handler, conn, addr) )
+                t.daemon = True
+                t.start()
+                connections.append( t )
+                connections = [c for c in connections if c.is_alive()]
+            self.__stop_reading()
+            for t in connections:
+                t.join()
+        finally:
+            self.close()
+
+    def stop( self ):
+        """stop serving (from another thread or a signal handler).
+
+        No more connections are accepted and no more requests read;
+        serve() returns once the requests in progress are answered.
+        """
+        self.__finished.set()
+
+    def __stop_reading( self ):
+        """let the connections stop waiting for further requests"""
+        with self.__conns_lock:
+            for conn in self.__conns:
+                try:
+                    conn.shutdown( socket.SHUT_RD )
+                except socket.error:
+                    pass
+
+    def __count_request( self ):
+        """count a received request; False if n requests were already served"""
+        with self.__n_lock:
+            if self.__finished.is_set():
+                return False
+            if self.__n is not None:
+                self.__n -= 1
+                if self.__n <= 0:
+                    self.__finished.set()
+            return True
+
+    def __serve_connection( self, handler, conn, addr ):
+        """read the requests of one connection and handle them"""
+        send_lock = threading.Lock()
+        requests = []
+        buffer = b""
+        shm_threshold = 0   #until the client says it reads shared memory
+        fds = [] if self.shm else None
+        try:
             while 1:
-                if n is not None  and  n_current >= n:
+                try:
+                    data, buffer = recvline( conn, buffer, self.limit, fds )
+                except socket.error:
                     break
-                conn, addr = self.s.accept()
-                self.log( "%s connected" % repr(addr) )
-                data = conn.recv(self.limit)
-                self.log( "%s --> %s" % (repr(addr), repr(data)) )
-                result = handler(data)
-                if data is not None:
+                if self.shm and data == SHM_HELLO:
+                    shm_threshold = self.shm_threshold
+                    continue
+                if data is None  or  not self.__count_request():
+                    break
+                try:
+                    data = self._loads( data, fds )
+                except (IOError, OSError, ValueError) as err:
+                    self.log( "%s invalid shared memory: %s" % (repr(addr), str(err)) )
+                    break
+                if self.log is not log_dummy:   #repr() copies the whole message
+                    self.log( "%s --> %s" % (repr(addr), repr(data)) )
+                self.__slots.acquire()
+                t = threading.Thread( target=self.__handle_request, args=(handler, data, conn, addr, send_lock, shm_threshold) )
+                t.daemon = True
+                t.start()
+                requests.append( t )
+                requests = [r for r in requests if r.is_alive()]
+                if self.__finished.is_set():
+                    break
+            for t in requests:
+                t.join()
+        finally:
+            self.log( "%s close" % repr(addr) )
+            with self.__conns_lock:
+                self.__conns.discard( conn )
+            conn.close()
+            while fds:
+                os.close( fds.pop() )
+
+    def __handle_request( self, handler, data, conn, addr, send_lock, shm_threshold=0 ):
+        """handle one request and send back the result"""
+        try:
+            start = time.time()
+            result = handler(data)
+            self.stat( "rpc_request", time.time() - start )
+            if result is not None:
+                if self.log is not log_dummy:   #repr() copies the whole message
                     self.log( "%s <-- %s" % (repr(addr), repr(result)) )
-                    conn.send( result )
-                self.log( "%s close" % repr(addr) )
-                conn.close()
-                n_current += 1
+                message, fd = self._dumps( result, shm_threshold )
+                with send_lock:
+                    start = time.time()
+                    sendmessage( conn, message, fd )
+                    self.stat( "socket_send", time.time() - start )
+        except socket.error as err:
+            self.log( "%s send failed: %s" % (repr(addr), str(err)) )
         finally:
-            self.close()
+            self.__slots.release()
 
 
 if hasattr(socket, 'AF_UNIX'):
     
     class TransportUnixSocket(TransportSocket):
         """Transport via Unix Domain Socket.
+
+        Client and server are on the same host, so large messages can be
+        handed over in shared memory instead of being copied through the
+        socket: with shm_threshold, messages of that many bytes or more
+        are written to an anonymous memory file, and only its descriptor
+        is passed over the socket (Linux only; elsewhere shm_threshold is
+        ignored).  A server only answers this way to clients which use
+        shm_threshold themselves.
         """
-        def __init__(self, addr=None, limit=4096, timeout=5.0, logfunc=log_dummy):
+        def __init__(self, addr=None, limit=4096, timeout=5.0, logfunc=log_dummy, persistent=False, threads=16, statfunc=stat_dummy, shm_threshold=0):
             """
             :Parameters:
                 - addr: "socket_file"
+                - shm_threshold: min. size (in bytes) of messages sent via
+                                 shared memory, 0=none
             :Note: | The socket-file is not deleted.
                    | If the socket-file begins with \x00, abstract sockets are used,
                      and no socket-file is created.
             :SeeAlso:   TransportSocket
             """
-            TransportSocket.__init__( self, addr, limit, socket.AF_UNIX, socket.SOCK_STREAM, timeout, logfunc )
+            TransportSocket.__init__( self, addr, limit, socket.AF_UNIX, socket.SOCK_STREAM, timeout, logfunc, persistent, threads, statfunc )
+            self.shm = SHM_AVAILABLE
+            self.shm_threshold = SHM_AVAILABLE and shm_threshold or 0
 
 class TransportTcpIp(TransportSocket):
     """Transport via TCP/IP.
     """
-    def __init__(self, addr=None, limit=4096, timeout=5.0, logfunc=log_dummy):
+    def __init__(self, addr=None, limit=4096, timeout=5.0, logfunc=log_dummy, persistent=False, threads=16, statfunc=stat_dummy):
         """
         :Parameters:
             - addr: ("host",port)
         :SeeAlso:   TransportSocket
         """
-        TransportSocket.__init__( self, addr, limit, socket.AF_INET, socket.SOCK_STREAM, timeout, logfunc )
+        TransportSocket.__init__( self, addr, limit, socket.AF_INET, socket.SOCK_STREAM, timeout, logfunc, persistent, threads, statfunc )
 
 
 #=========================================
@@ -865,7 +1128,12 @@ class ServerProxy:
 
     It works with different data/serializers and different transports.
 
-    Notifications and id-handling/multicall are not yet implemented.
+    Every request gets its own id, and responses are matched by id, so
+    several requests can be sent over one connection at once
+    (see _pipeline and MultiCall).
+
+    Notifications (requests without response) are sent via the _notify
+    attribute, e.g. proxy._notify.log("hello").
 
     :Example:
         see module-docstring
@@ -883,36 +1151,147 @@ class ServerProxy:
         if not isinstance(transport, Transport):
             raise ValueError('invalid "transport" (must be a Transport-instance)"')
         self.__transport = transport
+        self.__ids  = itertools.count(1)
+        self.__lock = threading.Lock()   #one request/pipeline on the transport at a time
+        self._notify = _notify(self.__notify)
 
     def __str__(self):
         return repr(self)
     def __repr__(self):
         return "<ServerProxy for %s, with serializer %s>" % (self.__transport, self.__data_serializer)
 
-    def __req( self, methodname, args=None, kwargs=None, id=0 ):
+    def __dumps_request( self, methodname, args, kwargs, id=None ):
+        """serialize a request, or a notification if id is None"""
         # JSON-RPC 1.0: only positional parameters
-        if len(kwargs) > 0 and isinstance(self.data_serializer, JsonRpc10):
+        if len(kwargs) > 0 and isinstance(self.__data_serializer, JsonRpc10):
             raise ValueError("Only positional parameters allowed in JSON-RPC 1.0")
         # JSON-RPC 2.0: only args OR kwargs allowed!
         if len(args) > 0 and len(kwargs) > 0:
             raise ValueError("Only positional or named parameters are allowed!")
         if len(kwargs) == 0:
-            req_str  = self.__data_serializer.dumps_request( methodname, args, id )
+            params = args
         else:
-            req_str  = self.__data_serializer.dumps_request( methodname, kwargs, id )
+            params = kwargs
+        if id is None:
+            return self.__data_serializer.dumps_notification( methodname, params )
+        else:
+            return self.__data_serializer.dumps_request( methodname, params, id )
+
+    def __req( self, methodname, args=None, kwargs=None ):
+        id = next(self.__ids)
+        req_str = self.__dumps_request( methodname, args, kwargs, id )
         try:
-            resp_str = self.__transport.sendrecv( req_str )
-        except Exception,err:
+            with self.__lock:
+                resp_str = self.__transport.sendrecv( req_str )
+        except socket.timeout as err:
+            raise RPCTimeoutError(err)
+        except Exception as err:
             raise RPCTransportError(err)
         resp = self.__data_serializer.loads_response( resp_str )
+        if resp[1] != id:
+            raise RPCInvalidRPC("Invalid Response, id %s does not match request-id %s." % (repr(resp[1]), repr(id)))
         return resp[0]
 
+    def __notify( self, methodname, args=None, kwargs=None ):
+        req_str = self.__dumps_request( methodname, args, kwargs )
+        try:
+            with self.__lock:
+                try:
+                    self.__transport.send( req_str )
+                finally:
+                    if not getattr(self.__transport, "persistent", False):
+                        self.__transport.close()
+        except Exception as err:
+            raise RPCTransportError(err)
+
+    def _pipeline( self, calls ):
+        """send several requests at once, and collect their responses.
+
+        All requests are written to the transport before the first response
+        is read, so the server can work on them concurrently. Responses may
+        arrive in any order and are matched to their requests by id.
+
+        :Parameters:
+            - calls: list of (methodname, args, kwargs)
+        :Returns:   list with the result of every call (in call-order);
+                    a failed call is represented by its RPCFault-instance
+        :Raises:    RPCTransportError, RPCParseError, RPCInvalidRPC
+        """
+        ids = []
+        req_strs = []
+        for methodname, args, kwargs in calls:
+            ids.append( next(self.__ids) )
+            req_strs.append( self.__dumps_request(methodname, args, kwargs, ids[-1]) )
+        results = {}
+        with self.__lock:
+            try:
+                try:
+                    for req_str in req_strs:
+                        self.__transport.send( req_str )
+                    while len(results) < len(ids):
+                        resp_str = self.__transport.recv()
+                        try:
+                            result, id = self.__data_serializer.loads_response( resp_str )
+                        except RPCFault as err:
+                            if err.id is None:
+                                raise
+                            result, id = err, err.id
+                        if id not in ids  or  id in results:
+                            raise RPCInvalidRPC("Invalid Response, unexpected id %s." % repr(id))
+                        results[id] = result
+                except RPCFault:
+                    self.__transport.close()
+                    raise
+                except Exception as err:
+                    self.__transport.close()
+                    raise RPCTransportError(err)
+            finally:
+                if not getattr(self.__transport, "persistent", False):
+                    self.__transport.close()
+        return [results[id] for id in ids]
+
     def __getattr__(self, name):
         # magic method dispatcher
         #  note: to call a remote object with an non-standard name, use
         #  result getattr(my_server_proxy, "strange-python-name")(args)
         return _method(self.__req, name)
 
+class _notify:
+    """dispatcher for notifications: proxy._notify.method(args)"""
+    def __init__(self, notify):
+        self.__notify = notify
+    def __getattr__(self, name):
+        return _method(self.__notify, name)
+
+class MultiCall:
+    """pipeline several calls over one connection (like xmlrpclib.MultiCall)
+
+    :Example:
+        >>> multicall = MultiCall( proxy )
+        >>> multicall.echo( "hello" )
+        >>> multicall.echo( "world" )
+        >>> list( multicall() )
+        ['hello', 'world']
+
+    Iterating over the result raises the RPCFault of a failed call.
+    """
+    def __init__(self, proxy):
+        self.__proxy = proxy
+        self.__calls = []
+    def __add(self, methodname, args, kwargs):
+        self.__calls.append( (methodname, args, kwargs) )
+    def __getattr__(self, name):
+        return _method(self.__add, name)
+    def __call__(self):
+        return _multicall_results( self.__proxy._pipeline(self.__calls) )
+
+def _multicall_results( results ):
+    """iterate over pipelined results, raising the faults"""
+    for result in results:
+        if isinstance(result, RPCFault):
+            raise result
+        yield result
+
 # request dispatcher
 class _method:
     """some "magic" to bind an RPC method to an RPC server.
@@ -1019,7 +1398,6 @@ class Server:
         :Returns: the data to send back or None if nothing should be sent back
         :Raises:  RPCFault (and maybe others)
         """
-        #TODO: id
         notification = False
         try:
             req = self.__data_serializer.loads_request( rpcstr )
@@ -1028,9 +1406,9 @@ class Server:
                 notification = True
             else:                   #request
                 method, params, id = req
-        except RPCFault, err:
+        except RPCFault as err:
             return self.__data_serializer.dumps_error( err, id=None )
-        except Exception, err:
+        except Exception as err:
             self.log( "%d (%s): %s" % (INTERNAL_ERROR, ERROR_MESSAGE[INTERNAL_ERROR], str(err)) )
             return self.__data_serializer.dumps_error( RPCFault(INTERNAL_ERROR, ERROR_MESSAGE[INTERNAL_ERROR]), id=None )
 
@@ -1044,11 +1422,11 @@ class Server:
                 result = self.funcs[method]( **params )
             else:
                 result = self.funcs[method]( *params )
-        except RPCFault, err:
+        except RPCFault as err:
             if notification:
                 return None
-            return self.__data_serializer.dumps_error( err, id=None )
-        except Exception, err:
+            return self.__data_serializer.dumps_error( err, id )
+        except Exception as err:
             if notification:
                 return None
             self.log( "%d (%s): %s" % (INTERNAL_ERROR, ERROR_MESSAGE[INTERNAL_ERROR], str(err)) )
@@ -1058,7 +1436,7 @@ class Server:
             return None
         try:
             return self.__data_serializer.dumps_response( result, id )
-        except Exception, err:
+        except Exception as err:
             self.log( "%d (%s): %s" % (INTERNAL_ERROR, ERROR_MESSAGE[INTERNAL_ERROR], str(err)) )
             return self.__data_serializer.dumps_error( RPCFault(INTERNAL_ERROR, ERROR_MESSAGE[INTERNAL_ERROR]), id )
 
@@ -1069,5 +1447,13 @@ class Server:
         """
         self.__transport.serve( self.handle, n )
 
+    def stop(self):
+        """stop serving gracefully: serve() returns when the requests
+        in progress are answered.
+
+        :See: TransportSocket.stop
+        """
+        self.__transport.stop()
+
 #=========================================
 
@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+#
+# metrics  - counters, gauges and latency histograms for the corenlp server
+# Copyright (c) 2014 Dustin Smith
+#   https://github.com/dasmith/stanford-corenlp-python
+# 
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+In-process instrumentation: counters, gauges and latency histograms,
+readable as a JSON-serializable snapshot (the `stats` RPC method) or in
+the Prometheus text format (optionally served over HTTP).
+
+    with metrics.REGISTRY.timer('parse_parser_results'):
+        results = parse_parser_results(incoming)
+
+Plus an opt-in profiler that runs individual requests under cProfile and
+aggregates them into one pstats file (see Profiler).
+"""
+
+import bisect
+import cProfile
+import os
+import pstats
+import threading
+import time
+import http.server
+from io import StringIO
+
+
+# upper bounds (in seconds) of the latency histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+           0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 60.0)
+
+
+class Histogram(object):
+    """
+    Counts observations in fixed buckets, Prometheus-style, so recording
+    is O(log buckets) and memory doesn't grow with the number of requests.
+    """
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the q-quantile (None if empty),
+        or "+Inf" beyond the last bucket -- as in Prometheus, and unlike
+        float('inf') valid in JSON
+        """
+        with self.lock:
+            if self.count == 0:
+                return None
+            rank = q * self.count
+            seen = 0
+            for bound, n in zip(self.buckets, self.counts):
+                seen += n
+                if seen >= rank:
+                    return bound
+        return '+Inf'
+
+    def cumulative(self):
+        """ [(upper bound, number of observations <= bound), ...] """
+        with self.lock:
+            result, seen = [], 0
+            for bound, n in zip(self.buckets + (float('inf'),), self.counts):
+                seen += n
+                result.append((bound, seen))
+            return result
+
+    def snapshot(self):
+        return {'count': self.count,
+                'sum': self.sum,
+                'p50': self.quantile(0.5),
+                'p95': self.quantile(0.95),
+                'p99': self.quantile(0.99),
+                'buckets': [[bound, n] for bound, n in self.cumulative()[:-1]]}
+
+
+class Timer(object):
+    """ Context manager observing its duration in a histogram """
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.registry.observe(self.name, time.time() - self.start)
+
+
+class Registry(object):
+    """
+    Named counters, gauges and latency histograms.  Gauges are either set
+    to a value or registered as a function that is called on every read.
+    """
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def incr(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        """ Sets a gauge to a number, or to a function returning one """
+        with self.lock:
+            self.gauges[name] = value
+
+    def histogram(self, name):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            return self.histograms[name]
+
+    def observe(self, name, seconds):
+        self.histogram(name).observe(seconds)
+
+    def timer(self, name):
+        return Timer(self, name)
+
+    def _gauge_values(self):
+        with self.lock:
+            gauges = list(self.gauges.items())
+        return dict((name, value() if callable(value) else value)
+                    for name, value in gauges)
+
+    def snapshot(self):
+        """ All current readings as a JSON-serializable dict """
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = list(self.histograms.items())
+        return {'counters': counters,
+                'gauges': self._gauge_values(),
+                'latency': dict((name, h.snapshot()) for name, h in histograms)}
+
+    def prometheus(self, prefix='corenlp'):
+        """ All current readings in the Prometheus text exposition format """
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        for name, value in counters:
+            lines.append('# TYPE %s_%s_total counter' % (prefix, name))
+            lines.append('%s_%s_total %s' % (prefix, name, value))
+        for name, value in sorted(self._gauge_values().items()):
+            lines.append('# TYPE %s_%s gauge' % (prefix, name))
+            lines.append('%s_%s %s' % (prefix, name, value))
+        for name, h in histograms:
+            metric = '%s_%s_seconds' % (prefix, name)
+            lines.append('# TYPE %s histogram' % metric)
+            for bound, n in h.cumulative():
+                le = bound == float('inf') and '+Inf' or repr(bound)
+                lines.append('%s_bucket{le="%s"} %d' % (metric, le, n))
+            lines.append('%s_sum %r' % (metric, h.sum))
+            lines.append('%s_count %d' % (metric, h.count))
+        return '\n'.join(lines) + '\n'
+
+
+# the registry the server and StanfordCoreNLP report to
+REGISTRY = Registry()
+
+
+class Profiler(object):
+    """
+    Runs requests under cProfile while enabled, and sums up their profiles.
+    The aggregate is written in the pstats format that `python -m pstats`,
+    snakeviz, gprof2dot etc. read.
+
+    Only one request is profiled at a time (since Python 3.12 there can
+    be only one active profiler); those arriving meanwhile just run.
+
+    Starts enabled if the environment variable CORENLP_PROFILE is set, and
+    writes its files to CORENLP_PROFILE_DIR (default: current directory).
+    """
+    def __init__(self, enabled=False, directory='.'):
+        self.enabled = enabled
+        self.directory = directory
+        self.stats = None
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.running = threading.Lock()   # held while a request is profiled
+
+    def call(self, function, *args):
+        """ Returns function(*args), profiling the call if enabled """
+        if not self.enabled or not self.running.acquire(False):
+            return function(*args)
+        try:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:   # another profiler is active
+                return function(*args)
+            try:
+                result = function(*args)
+            finally:
+                profile.disable()
+        finally:
+            self.running.release()
+        try:
+            with self.lock:
+                if self.stats is None:
+                    self.stats = pstats.Stats(profile)
+                else:
+                    self.stats.add(profile)
+                self.requests += 1
+        except Exception:
+            pass   # a lost profile mustn't lose the result
+        return result
+
+    def reset(self):
+        with self.lock:
+            self.stats = None
+            self.requests = 0
+
+    def summary(self, n=25, sort='cumulative'):
+        """ The n most expensive functions, as printed by pstats """
+        with self.lock:
+            if self.stats is None:
+                return ''
+            stream = StringIO()
+            self.stats.stream = stream
+            self.stats.sort_stats(sort).print_stats(n)
+            return stream.getvalue()
+
+    def dump(self):
+        """
+        Writes the aggregated profile to a new file in self.directory and
+        returns its path (None if nothing was profiled yet)
+        """
+        path = os.path.join(self.directory, 'corenlp-%d-%s.prof' % (
+            os.getpid(), time.strftime('%Y%m%d-%H%M%S')))
+        with self.lock:
+            if self.stats is None:
+                return None
+            self.stats.dump_stats(path)
+        return path
+
+
+PROFILER = Profiler(bool(os.environ.get('CORENLP_PROFILE')),
+                    os.environ.get('CORENLP_PROFILE_DIR', '.'))
+
+
+class Drift(object):
+    """
+    How much slower a series of observations got: the ratio of their
+    recent (exponentially weighted) average to the average of the first
+    `baseline` ones.
+    """
+    def __init__(self, baseline=50, alpha=0.05):
+        self.baseline_size = baseline
+        self.alpha = alpha
+        self.n = 0
+        self.baseline = 0.0
+        self.recent = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.n += 1
+            if self.n <= self.baseline_size:
+                self.baseline += (value - self.baseline) / self.n
+                self.recent = self.baseline
+            else:
+                self.recent += self.alpha * (value - self.recent)
+
+    def ratio(self):
+        """ recent / baseline, or None until the baseline is complete """
+        with self.lock:
+            if self.n < self.baseline_size or self.baseline <= 0:
+                return None
+            return self.recent / self.baseline
+
+
+def process_usage(pid):
+    """
+    The resident memory (in bytes) and the CPU time used so far (user plus
+    system, in seconds) of a process, from /proc; None where there is no
+    /proc or no such process.
+    """
+    try:
+        with open('/proc/%d/statm' % pid) as f:
+            rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        with open('/proc/%d/stat' % pid) as f:
+            # the fields after the command name, which may contain spaces
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / float(os.sysconf('SC_CLK_TCK'))
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+    return rss, cpu
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """ Answers GET /metrics with the registry in Prometheus format """
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_http(addr, registry=REGISTRY):
+    """
+    Serves the registry for Prometheus on http://host:port/metrics from a
+    background thread and returns the HTTPServer.
+    """
+    class Handler(MetricsHandler):
+        pass
+    Handler.registry = registry
+    httpd = http.server.HTTPServer(addr, Handler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return httpd
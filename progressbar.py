@@ -171,7 +171,7 @@ class Bar(ProgressBarWidgetHFill):
         self.right = right
 
     def _format_marker(self, pbar):
-        if isinstance(self.marker, (str, unicode)):
+        if isinstance(self.marker, str):
             return self.marker
         else:
             return self.marker.update(pbar)
@@ -206,7 +206,7 @@ class ProgressBar(object):
 
     The simple use is like this:
     >>> pbar = ProgressBar().start()
-    >>> for i in xrange(100):
+    >>> for i in range(100):
     ...    # do something
     ...    pbar.update(i+1)
     ...
@@ -270,7 +270,7 @@ class ProgressBar(object):
                 r.append(w)
                 hfill_inds.append(i)
                 num_hfill += 1
-            elif isinstance(w, (str, unicode)):
+            elif isinstance(w, str):
                 r.append(w)
                 currwidth += len(w)
             else:
@@ -279,7 +279,7 @@ class ProgressBar(object):
                 r.append(weval)
         for iw in hfill_inds:
             r[iw] = r[iw].update(self,
-                                 (self.term_width - currwidth) / num_hfill)
+                                 (self.term_width - currwidth) // num_hfill)
         return r
 
     def _format_line(self):
@@ -321,7 +321,7 @@ class ProgressBar(object):
 
         It returns self so you can use it like this:
         >>> pbar = ProgressBar().start()
-        >>> for i in xrange(100):
+        >>> for i in range(100):
         ...    # do something
         ...    pbar.update(i+1)
         ...
@@ -406,15 +406,15 @@ def example5():
 
 def main():
     example1()
-    print
+    print()
     example2()
-    print
+    print()
     example3()
-    print
+    print()
     example4()
-    print
+    print()
     example5()
-    print
+    print()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+#
+# store  - append-only on-disk store of parse results
+# Copyright (c) 2014 Dustin Smith
+#   https://github.com/dasmith/stanford-corenlp-python
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+Parse results on disk, with random access to documents and sentences.
+
+A store is two append-only files: PATH holds the results as JSON, one
+after the other, and PATH.index has a line of JSON per result giving its
+key, byte range and the byte ranges of its sentences.  The index is
+loaded into memory on opening; the data is read through mmap, so looking
+up a document or a single sentence decodes nothing but that.
+
+    store = Store('corpus.store')
+    store.put('doc1', nlp._parse(text))
+    store.get_sentence('doc1', 0)['parsetree']
+
+StanfordCoreNLPPool uses a store as its result cache, keyed by text_key().
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import threading
+
+
+def text_key(text, options=()):
+    """
+    The key of a text's result in a cache.  `options` names the output
+    options (such as "tree") the result was produced with.
+    """
+    if isinstance(text, str):
+        text = text.encode('utf-8')
+    return hashlib.sha1(text).hexdigest() + ''.join(':' + option for option in options)
+
+
+def encode(result):
+    """
+    Returns the result in JSON (as UTF-8 bytes), and the (offset, length)
+    of each of its sentences within them
+    """
+    head = '{"sentences": ['
+    parts, spans, pos = [head], [], len(head)
+    for i, sentence in enumerate(result.get('sentences', [])):
+        if i:
+            parts.append(', ')
+            pos += 2
+        s = json.dumps(sentence)
+        parts.append(s)
+        spans.append((pos, len(s)))
+        pos += len(s)
+    rest = dict((k, v) for k, v in result.items() if k != 'sentences')
+    parts.append(rest and '], ' + json.dumps(rest)[1:] or ']}')
+    # json.dumps escapes non-ASCII characters, so the offsets hold for the bytes
+    return ''.join(parts).encode('utf-8'), spans
+
+
+class Store(object):
+    """
+    Append-only store of parse results by key.  Putting a key again
+    shadows the older result.  Safe to use from several threads.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.index = {}   # key -> (offset, length, sentence spans)
+        self.lock = threading.Lock()
+        length = 0
+        if os.path.exists(path + '.index'):
+            for line in open(path + '.index', 'rb'):
+                # a line cut off by an interruption doesn't count
+                if not line.endswith(b'\n'):
+                    break
+                key, offset, size, spans = json.loads(line)
+                self.index[key] = (offset, size, spans)
+                length += len(line)
+        self.data = open(path, 'a+b')
+        self.indexfile = open(path + '.index', 'ab')
+        self.indexfile.truncate(length)
+        self.size = os.path.getsize(path)
+        self.map = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def keys(self):
+        return list(self.index.keys())
+
+    def put(self, key, result):
+        """ Appends the result (a Python data-structure) under key """
+        data, spans = encode(result)
+        with self.lock:
+            offset = self.size
+            self.data.write(data)
+            self.data.flush()
+            self.size += len(data)
+            # the data is complete before the index points to it
+            self.indexfile.write((json.dumps([key, offset, len(data), spans]) + '\n').encode('utf-8'))
+            self.indexfile.flush()
+            self.index[key] = (offset, len(data), spans)
+
+    def _read(self, offset, length):
+        with self.lock:
+            if self.map is None or offset + length > len(self.map):
+                # the file grew since it was mapped
+                if self.map is not None:
+                    self.map.close()
+                self.map = mmap.mmap(self.data.fileno(), 0, access=mmap.ACCESS_READ)
+            return self.map[offset:offset + length]
+
+    def get_raw(self, key):
+        """ The result stored under key in JSON (as bytes), or None """
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+        return self._read(entry[0], entry[1])
+
+    def get(self, key):
+        """ The result stored under key, or None """
+        data = self.get_raw(key)
+        return json.loads(data) if data is not None else None
+
+    def get_sentence(self, key, i):
+        """
+        Sentence i of the result stored under key, without reading the
+        rest of it.  Raises KeyError or IndexError if there is none.
+        """
+        offset, length, spans = self.index[key]
+        start, size = spans[i]
+        return json.loads(self._read(offset + start, size))
+
+    def close(self):
+        with self.lock:
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+            self.data.close()
+            self.indexfile.close()
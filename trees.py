@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#
+# trees  - compact encoding of phrase-structure trees
+# Copyright (c) 2014 Dustin Smith
+#   https://github.com/dasmith/stanford-corenlp-python
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+Parse trees as flat arrays instead of bracketed strings.  The nodes of a
+tree (without the words) are numbered in pre-order, the root being 0:
+
+  labels   the label of each node, e.g. "NP"
+  parents  the parent of each node, -1 for the root
+  spans    the [start, end) token indices each node covers
+
+A server started with --trees adds this as 'tree' to every sentence.
+The functions below take a sentence and otherwise encode its 'parsetree'
+on first use, so they work without that too -- and without nltk:
+
+    for np in trees.constituents(sentence, 'NP'):
+        print(' '.join(trees.words(sentence, np)))
+"""
+
+import re
+
+
+TREE_TOKEN = re.compile(r"\(|\)|[^\s()]+")
+
+
+def encode(parsetree):
+    """ The labels, parents and spans of a bracketed tree """
+    labels, parents, spans = [], [], []
+    stack = []
+    token = 0
+    opened = False
+    for t in TREE_TOKEN.findall(parsetree):
+        if t == '(':
+            opened = True
+        elif t == ')':
+            spans[stack.pop()][1] = token
+        elif opened:
+            parents.append(stack[-1] if stack else -1)
+            labels.append(t)
+            spans.append([token, token])
+            stack.append(len(labels) - 1)
+            opened = False
+        else:
+            token += 1   # a word
+    return {'labels': labels, 'parents': parents, 'spans': spans}
+
+
+def tree(sentence):
+    """ The sentence's encoded tree, encoding 'parsetree' if necessary """
+    if 'tree' not in sentence:
+        sentence['tree'] = encode(sentence['parsetree'])
+    return sentence['tree']
+
+
+def children(sentence, node=None):
+    """
+    The child nodes of node, or a list of the children of every node if
+    node is None
+    """
+    parents = tree(sentence)['parents']
+    if node is not None:
+        return [i for i in range(node + 1, len(parents)) if parents[i] == node]
+    result = [[] for p in parents]
+    for i, p in enumerate(parents):
+        if p >= 0:
+            result[p].append(i)
+    return result
+
+
+def span(sentence, node=0):
+    """ The (start, end) token indices covered by node """
+    return tuple(tree(sentence)['spans'][node])
+
+
+def words(sentence, node=0):
+    """ The words covered by node """
+    start, end = span(sentence, node)
+    return [word for word, attrs in sentence['words'][start:end]]
+
+
+def constituents(sentence, label):
+    """ The nodes with the given label, in pre-order """
+    return [i for i, l in enumerate(tree(sentence)['labels']) if l == label]
+
+
+def covering(sentence, start, end):
+    """ The smallest node covering the tokens from start to end """
+    best = 0
+    for i, (s, e) in enumerate(tree(sentence)['spans']):
+        if s <= start and end <= e:
+            best = i   # pre-order: later covering nodes are smaller
+    return best
+
+
+def to_string(sentence, node=0):
+    """ The subtree at node in brackets, as in 'parsetree' """
+    t = tree(sentence)
+    kids = children(sentence)
+    def build(i):
+        if not kids[i]:
+            return "(%s %s)" % (t['labels'][i], " ".join(words(sentence, i)))
+        return "(%s %s)" % (t['labels'][i], " ".join(build(k) for k in kids[i]))
+    return build(node)